@@ -0,0 +1,261 @@
+# cathay_alerts.py
+"""
+Price-alert subscriptions matched against enriched search results.
+
+A subscription is a dict (one entry of a YAML list, see load_subscriptions()):
+
+  - id: hkg-lhr-j
+    hub: HKG
+    dest: LHR
+    cabin: BUSINESS          # or ANY (default)
+    currency: HKD            # or ANY (default)
+    date_from: 2026-03-01    # HUB→DEST departure window, both optional
+    date_to: 2026-04-30
+    max_price: 30000         # HUB⇄DEST offers at or under this
+    feeder_max_price: 25000  # NEW→HUB→DEST offers at or under this (defaults to max_price)
+
+Subscriptions are indexed by (kind, hub, dest, cabin, currency, month) and kept sorted
+by threshold inside each bucket, so an offer only looks at the few buckets it can fall
+in and stops at the first subscription whose threshold is below its price.
+"""
+import bisect
+import itertools
+import json
+import os
+import threading
+from datetime import date
+from urllib.request import Request
+
+import yaml
+
+import cathay_core as core
+
+ANY = "ANY"
+ANY_MONTH = "*"
+
+# Windows longer than this go into the any-month bucket instead of one bucket per month
+MAX_INDEXED_MONTHS = 24
+
+
+def load_subscriptions(path: str) -> list:
+    if not path or not os.path.exists(path):
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        data = yaml.safe_load(f) or []
+    return data.get("alerts", []) if isinstance(data, dict) else data
+
+
+def _months(date_from: str, date_to: str) -> list:
+    if not date_from or not date_to:
+        return [ANY_MONTH]
+    y, m = int(date_from[:4]), int(date_from[5:7])
+    y_end, m_end = int(date_to[:4]), int(date_to[5:7])
+    months = []
+    while (y, m) <= (y_end, m_end):
+        months.append(f"{y:04d}-{m:02d}")
+        if len(months) > MAX_INDEXED_MONTHS:
+            return [ANY_MONTH]
+        y, m = (y + 1, 1) if m == 12 else (y, m + 1)
+    return months
+
+
+def offer_alert_fields(r: dict):
+    """
+    Pulls (kind, hub, dest, cabin, currency, depart_date, price) out of an enriched
+    result (see core.enrich_offer()), or None if the offer has no HUB→DEST leg.
+    """
+    offer = r.get("raw_offer") or {}
+    its = offer.get("itineraries") or []
+    kind = "feeder" if r.get("type") == "NEW→HUB→DEST" else "direct"
+    main = its[1] if kind == "feeder" and len(its) > 1 else (its[0] if its else {})
+    segs = main.get("segments") or []
+    if not segs:
+        return None
+
+    hub = r.get("via_hub") if kind == "feeder" else r.get("new_origin")
+    dest = (segs[-1].get("arrival") or {}).get("iataCode")
+    depart = ((segs[0].get("departure") or {}).get("at") or "")[:10]
+
+    main_ids = {s.get("id") for s in segs}
+    cabins = {s.get("cabin") for s in r.get("segments", []) if s.get("segment_id") in main_ids}
+    cabin = cabins.pop() if len(cabins) == 1 else "UNKNOWN"
+    if cabin == "UNKNOWN" and r.get("travel_class_filter", ANY) != ANY:
+        cabin = r["travel_class_filter"]
+
+    return kind, hub, dest, cabin, (r.get("currency") or "").upper(), depart, core.offer_price(offer)
+
+
+class AlertEngine:
+    """
+    Subscription store with a bucketed index, plus the sinks matches are sent to.
+
+    Sinks are callables taking one alert dict; a failing sink is counted in
+    stats["sink_errors"] and never interrupts the search that produced the offer.
+    """
+
+    def __init__(self, subscriptions=(), sinks=()):
+        self.sinks = list(sinks)
+        self.stats = {"checked": 0, "candidates": 0, "alerts": 0, "sink_errors": 0}
+        self._subs = {}
+        self._buckets = {}
+        self._keys_by_sub = {}
+        self._sent = set()
+        self._next_id = 0
+        self._lock = threading.Lock()
+        for sub in subscriptions:
+            self.add(sub)
+
+    def __len__(self):
+        return len(self._subs)
+
+    def add(self, sub: dict) -> str:
+        sub = dict(sub)
+        for k in ("hub", "dest"):
+            sub[k] = (sub.get(k) or "").upper()
+            if not sub[k]:
+                raise ValueError(f"Alert subscription {sub.get('id', '(no id)')} has no {k}")
+        for k in ("cabin", "currency"):
+            sub[k] = (sub.get(k) or ANY).upper()
+        for k in ("date_from", "date_to"):
+            if isinstance(sub.get(k), date):  # YAML parses bare dates
+                sub[k] = sub[k].isoformat()
+
+        thresholds = {}
+        if sub.get("max_price") is not None:
+            thresholds["direct"] = float(sub["max_price"])
+        feeder_max = sub.get("feeder_max_price", sub.get("max_price"))
+        if feeder_max is not None:
+            thresholds["feeder"] = float(feeder_max)
+
+        with self._lock:
+            sub_id = sub.get("id")
+            if not sub_id:
+                # A counter, so a generated id never reuses one freed by remove()
+                self._next_id += 1
+                while f"alert-{self._next_id}" in self._subs:
+                    self._next_id += 1
+                sub_id = f"alert-{self._next_id}"
+            sub_id = sub["id"] = str(sub_id)
+            if sub_id in self._subs:
+                self._remove_locked(sub_id)
+            self._subs[sub_id] = sub
+            keys = []
+            for kind, limit in thresholds.items():
+                for month in _months(sub.get("date_from"), sub.get("date_to")):
+                    key = (kind, sub["hub"], sub["dest"], sub["cabin"], sub["currency"], month)
+                    # Sorted ascending by -threshold: highest thresholds first
+                    bisect.insort(self._buckets.setdefault(key, []), (-limit, sub_id))
+                    keys.append((key, (-limit, sub_id)))
+            self._keys_by_sub[sub_id] = keys
+        return sub_id
+
+    def remove(self, sub_id: str):
+        with self._lock:
+            self._remove_locked(sub_id)
+
+    def match(self, r: dict) -> list:
+        """Returns the subscriptions an enriched result satisfies."""
+        fields = offer_alert_fields(r)
+        if fields is None:
+            return []
+        kind, hub, dest, cabin, currency, depart, price = fields
+
+        matches = []
+        with self._lock:
+            self.stats["checked"] += 1
+            for c, cur, month in itertools.product({cabin, ANY}, {currency, ANY}, (depart[:7], ANY_MONTH)):
+                bucket = self._buckets.get((kind, hub, dest, c, cur, month))
+                if not bucket:
+                    continue
+                # Entries before this point have threshold >= price
+                end = bisect.bisect_right(bucket, (-price, "\uffff"))
+                for _, sub_id in bucket[:end]:
+                    self.stats["candidates"] += 1
+                    sub = self._subs[sub_id]
+                    if sub.get("date_from") and depart < sub["date_from"]:
+                        continue
+                    if sub.get("date_to") and depart > sub["date_to"]:
+                        continue
+                    matches.append(sub)
+        return matches
+
+    def process(self, results: list) -> list:
+        """Matches every enriched result and sends new alerts to the sinks."""
+        alerts = []
+        for r in results:
+            for sub in self.match(r):
+                fp = (sub["id"], r.get("new_origin"), r.get("price_amount"),
+                      tuple(s.get("flight") for s in r.get("segments", [])),
+                      tuple(s.get("dep_at") for s in r.get("segments", [])))
+                with self._lock:
+                    if fp in self._sent:
+                        continue
+                    self._sent.add(fp)
+                alerts.append(self._alert(sub, r))
+
+        for alert in alerts:
+            for sink in self.sinks:
+                try:
+                    sink(alert)
+                except Exception:
+                    with self._lock:
+                        self.stats["sink_errors"] += 1
+        with self._lock:
+            self.stats["alerts"] += len(alerts)
+        return alerts
+
+    def _alert(self, sub: dict, r: dict) -> dict:
+        return {
+            "alert_id": sub["id"],
+            "subscription": sub,
+            "type": r.get("type"),
+            "new_origin": r.get("new_origin"),
+            "via_hub": r.get("via_hub"),
+            "price_amount": r.get("price_amount"),
+            "currency": r.get("currency"),
+            "total_minutes": r.get("total_minutes"),
+            "stops": r.get("stops"),
+            "flights": [f"{s.get('flight')} {s.get('from')}→{s.get('to')} {s.get('dep_at') or ''}"
+                        for s in r.get("segments", [])],
+        }
+
+    def _remove_locked(self, sub_id: str):
+        self._subs.pop(sub_id, None)
+        for key, entry in self._keys_by_sub.pop(sub_id, []):
+            bucket = self._buckets.get(key)
+            if not bucket:
+                continue
+            i = bisect.bisect_left(bucket, entry)
+            if i < len(bucket) and bucket[i] == entry:
+                del bucket[i]
+            if not bucket:
+                del self._buckets[key]
+
+
+class FileSink:
+    """Appends each alert as one JSON line."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def __call__(self, alert: dict):
+        line = json.dumps(alert, ensure_ascii=False)
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+
+class WebhookSink:
+    """POSTs each alert as JSON to a (local) HTTP endpoint through the pooled transport."""
+
+    def __init__(self, url: str, timeout: float = 10.0):
+        self.url = url
+        self.timeout = timeout
+
+    def __call__(self, alert: dict):
+        req = Request(self.url, data=json.dumps(alert).encode(), method="POST",
+                      headers={"Content-Type": "application/json"})
+        resp = core.HTTP_TRANSPORT(req, timeout=self.timeout)
+        if resp.status >= 400:
+            raise RuntimeError(f"Alert webhook error: [{resp.status}] {self.url}")
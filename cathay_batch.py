@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+# cathay_batch.py
+"""
+Batch runner: many HUB/DEST/date/cabin searches from one job file.
+
+Each line of the job file is one JSON object; only hub, dest, depart and return_date
+are required, the rest default like the CLI:
+
+  {"id": "hkg-lhr-j", "hub": "HKG", "dest": "LHR", "depart": "2026-12-01", "return_date": "2026-12-10",
+   "cabin": "BUSINESS", "currency": "HKD", "adults": 1, "regions": ["Taiwan", "Japan"],
+   "feeders": true, "budget": 40, "feeder_radius": 800, "feeder_countries": ["TW"]}
+
+All jobs are planned up front (core.plan_search_calls()) and their calls merged by
+request identity (core.search_call_key()), so a call two jobs have in common is made
+once. The unique calls run on one worker pool behind one rate limiter and circuit
+breaker (keyed per route, DEST and dates, so one bad job cannot trip another's
+routes), through the shared client and keep-alive connections. Calls that a job
+with a budget relies on are never hedged. Each job is written
+to the output file (JSONL, input order) as soon as all of its calls are done.
+
+  python cathay_batch.py jobs.jsonl --out results.jsonl --env production --workers 8
+"""
+import argparse
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cathay_core as core
+
+DEFAULT_REGIONS = ["China", "Singapore", "Malaysia", "Indonesia", "Japan", "Korea", "Taiwan"]
+
+
+def load_jobs(path: str) -> list:
+    jobs = []
+    with open(path, "r", encoding="utf-8") as f:
+        for n, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            job = json.loads(line)
+            missing = [k for k in ("hub", "dest", "depart", "return_date") if not job.get(k)]
+            if missing:
+                raise ValueError(f"{path}:{n}: job is missing {', '.join(missing)}")
+            job.setdefault("id", f"job-{len(jobs) + 1}")
+            jobs.append(job)
+    return jobs
+
+
+def _job_request(job: dict) -> dict:
+    # Upstream parameters of a job, normalised the way the CLI normalises its flags
+    cabin = (job.get("cabin") or "ANY").upper()
+    if cabin not in core.ALLOWED_TRAVEL_CLASSES:
+        raise ValueError(f"{job['id']}: cabin must be one of {sorted(core.ALLOWED_TRAVEL_CLASSES)}")
+    return {
+        "hub": job["hub"].upper(),
+        "dest": job["dest"].upper(),
+        "depart_date": job["depart"],
+        "return_date": job["return_date"],
+        "adults": int(job.get("adults", 1)),
+        "currency": (job.get("currency") or "HKD").upper(),
+        "travel_class": cabin,
+        "regions": job.get("regions", DEFAULT_REGIONS),
+        "enable_feeders": bool(job.get("feeders", True)),
+        "max_detour_ratio": float(job.get("max_detour_ratio", core.MAX_DETOUR_RATIO)),
+        "max_added_miles": float(job.get("max_added_miles", core.MAX_ADDED_MILES)),
+        "call_budget": job.get("budget"),
+        "feeder_radius_miles": job.get("feeder_radius"),
+        "feeder_nearest": job.get("feeder_nearest"),
+        "feeder_countries": job.get("feeder_countries"),
+    }
+
+
+class BatchRunner:
+    """
+    Runs jobs against one shared client, call cache, rate limiter, breaker and pool.
+
+    The cache holds one future per unique request; it is reference-counted by the jobs
+    still waiting on it, so responses are dropped once every job using them is written.
+    """
+
+    def __init__(self, client_id: str, client_secret: str, hostname: str = None, workers: int = 4,
+                 rate: float = None, call_timeout: float = None, hedge_after: float = None):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.hostname = hostname
+        self.workers = workers
+        self.call_timeout = call_timeout
+        self.hedge_after = hedge_after
+        if rate is None:
+            rate = core.AMADEUS_RATE_LIMITS.get(hostname or "test", core.AMADEUS_RATE_LIMITS["test"])
+        self.limiter = core.RateLimiter(rate)
+        self.breaker = core.CircuitBreaker()
+        self.stats = {"jobs": 0, "planned_calls": 0, "unique_calls": 0, "failed_calls": 0}
+        self._cache = {}
+        self._refs = {}
+        self._lock = threading.Lock()
+
+    def _call(self, call: dict, req: dict, hedge_after: float = None):
+        # Runs on a pool worker; returns (offers, error message or None)
+        key = core.breaker_key(call)
+        if not self.breaker.allow(key):
+            return [], "skipped: circuit open after repeated failures"
+
+        def attempt():
+            # Hedged duplicates wait for the limiter too
+            self.limiter.acquire()
+            return core.run_search_call(call, self.client_id, self.client_secret, req["adults"],
+                                        req["currency"], req["travel_class"], self.hostname)
+
+        try:
+            offers = core.call_with_deadline(attempt, self.call_timeout, hedge_after)
+        except Exception as e:
+            if core.is_route_failure(e):
+                self.breaker.record_failure(key)
+            with self._lock:
+                self.stats["failed_calls"] += 1
+            return [], str(e)
+        self.breaker.record_success(key)
+        return offers, None
+
+    def plan(self, jobs: list) -> list:
+        """[(job, request params, plan, [call keys])] for every job, counting shared calls."""
+        planned = []
+        for job in jobs:
+            req = _job_request(job)
+            plan = core.plan_search_calls(
+                req["hub"], req["dest"], req["depart_date"], req["return_date"], req["regions"],
+                req["enable_feeders"], req["max_detour_ratio"], req["max_added_miles"], req["call_budget"],
+                req["feeder_radius_miles"], req["feeder_nearest"], req["feeder_countries"],
+            )
+            keys = [core.search_call_key(c, req["adults"], req["currency"], req["travel_class"], self.hostname)
+                    for c in plan["calls"]]
+            planned.append((job, req, plan, keys))
+        return planned
+
+    def run(self, jobs: list, out_path: str, on_job=None) -> dict:
+        planned = self.plan(jobs)
+        self.stats["jobs"] = len(planned)
+
+        # A hedge is an extra call, so calls any budgeted job relies on are never hedged
+        budgeted = {key for _, req, _, keys in planned if req["call_budget"] is not None for key in keys}
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="batch") as pool:
+            # Submit in job order so the first jobs finish (and are written) first
+            for job, req, plan, keys in planned:
+                self.stats["planned_calls"] += len(keys)
+                for call, key in zip(plan["calls"], keys):
+                    self._refs[key] = self._refs.get(key, 0) + 1
+                    if key not in self._cache:
+                        hedge_after = None if key in budgeted else self.hedge_after
+                        self._cache[key] = pool.submit(self._call, call, req, hedge_after)
+                        self.stats["unique_calls"] += 1
+
+            with open(out_path, "w", encoding="utf-8") as out:
+                for job, req, plan, keys in planned:
+                    record = self._job_record(job, plan, keys)
+                    out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                    out.flush()
+                    if on_job is not None:
+                        on_job(record)
+        return self.stats
+
+    def _job_record(self, job: dict, plan: dict, keys: list) -> dict:
+        results = []
+        errors = {}
+        for call, key in zip(plan["calls"], keys):
+            offers, err = self._cache[key].result()
+            results.append(offers)
+            if err:
+                errors.setdefault(call["route"], []).append(err)
+            self._refs[key] -= 1
+            if not self._refs[key]:
+                del self._refs[key]
+                del self._cache[key]
+
+        superset = core.collect_search_results(plan, results)
+        superset["errors"] = errors
+        direct_prices = [core.offer_price(o) for o in superset["direct"]]
+        feeder_best = min(superset["feeders"], key=lambda x: core.offer_price(x[1]), default=None)
+        return {
+            "job": job,
+            "cheapest_direct": min(direct_prices) if direct_prices else None,
+            "cheapest_feeder": {"new_origin": feeder_best[0], "price": core.offer_price(feeder_best[1])}
+            if feeder_best else None,
+            "calls": superset["calls"],
+            "dropped_by_budget": superset["dropped_by_budget"],
+            "pruned": superset["pruned"],
+            "errors": errors,
+            "direct": superset["direct"],
+            "feeders": superset["feeders"],
+        }
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Run many HUB/DEST searches from a JSONL job file with shared calls.")
+    ap.add_argument("jobs", help="JSONL job file, one search per line")
+    ap.add_argument("--out", default="batch_results.jsonl", help="JSONL output, one line per job")
+    ap.add_argument("--env", choices=["test", "production"], default="test")
+    ap.add_argument("--host", help="Amadeus base URL instead of --env (e.g. a cathay_loadtest.py --serve-only stand-in)")
+    ap.add_argument("--workers", type=int, default=4)
+    ap.add_argument("--rate", type=float, help="Max calls per second (default: the environment's rate limit)")
+    ap.add_argument("--call-timeout", type=float, default=30.0, help="Per-call deadline in seconds")
+    ap.add_argument("--hedge-after", type=float, help="Send a hedged duplicate after this many seconds")
+    ap.add_argument("--dry-run", action="store_true", help="Print planned vs unique calls, make no API calls")
+    args = ap.parse_args()
+
+    hostname = args.host or ("production" if args.env == "production" else None)
+    jobs = load_jobs(args.jobs)
+
+    cid = os.getenv("AMADEUS_CLIENT_ID")
+    csec = os.getenv("AMADEUS_CLIENT_SECRET")
+    runner = BatchRunner(cid, csec, hostname, workers=args.workers, rate=args.rate,
+                         call_timeout=args.call_timeout, hedge_after=args.hedge_after)
+
+    if args.dry_run:
+        planned = runner.plan(jobs)
+        total = sum(len(keys) for *_, keys in planned)
+        unique = len({k for *_, keys in planned for k in keys})
+        for job, _, _, keys in planned:
+            print(f"{job['id']}: {len(keys)} calls")
+        seconds = core.estimate_plan_seconds(unique, hostname, workers=args.workers, rate=runner.limiter.rate)
+        print(f"Jobs: {len(planned)} | Planned calls: {total} | Unique calls: {unique} "
+              f"| Estimated time: ~{seconds:.0f}s ({args.workers} workers, ~{core.AVG_CALL_SECONDS:g}s per call, "
+              f"at most {runner.limiter.rate:g} calls/s)")
+        return
+
+    if not cid or not csec:
+        raise SystemExit("Missing AMADEUS_CLIENT_ID / AMADEUS_CLIENT_SECRET env vars")
+
+    def on_job(record):
+        direct = record["cheapest_direct"]
+        feeder = record["cheapest_feeder"]
+        line = f"{record['job']['id']}: HUB⇄DEST {direct if direct is not None else '-'}"
+        if feeder:
+            line += f" | best feeder {feeder['new_origin']} {feeder['price']}"
+        if record["errors"]:
+            line += f" | {len(record['errors'])} routes with errors"
+        print(line, flush=True)
+
+    t0 = time.perf_counter()
+    stats = runner.run(jobs, args.out, on_job)
+    print(f"\nJobs: {stats['jobs']} | Planned calls: {stats['planned_calls']} | Unique calls: {stats['unique_calls']} "
+          f"| Failed: {stats['failed_calls']} | {time.perf_counter() - t0:.1f}s -> {args.out}")
+
+
+if __name__ == "__main__":
+    main()
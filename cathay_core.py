@@ -1,16 +1,39 @@
 # cathay_core.py
+import http.client
+import io
+import itertools
+import json
+import functools
 import math
 import re
 import os
+import socket
+import threading
+import time
+import zlib
 import yaml
 import airportsdata
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from datetime import datetime, timedelta
+from urllib.error import URLError
+from urllib.parse import urlsplit
+from urllib.request import Request
+from urllib.response import addinfourl
 from amadeus import Client, ResponseError
+from amadeus.client.access_token import AccessToken
+
+try:
+    import ijson
+except ImportError:  # fall back to parsing the whole body with json
+    ijson = None
 
 ISO_DUR_RE = re.compile(r"^PT(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?$")
 
 ALLOWED_TRAVEL_CLASSES = {"ANY", "ECONOMY", "PREMIUM_ECONOMY", "BUSINESS", "FIRST"}
 
+FLIGHT_OFFERS_PATH = "/v2/shopping/flight-offers"
+MAX_FLIGHT_OFFERS = 250  # Amadeus upper bound for searchCriteria.maxFlightOffers
+
 # Candidate NEW ORIGINS by region (editable)
 NEW_ORIGIN_POOLS = {
     "China": ["PEK", "PKX", "PVG", "SHA", "CAN", "SZX", "CTU", "XIY", "WUH", "KMG"],
@@ -22,6 +45,49 @@ NEW_ORIGIN_POOLS = {
     "Taiwan": ["TPE", "KHH"],
 }
 
+# Airports Cathay Pacific serves (editable). Radius/nearest feeder discovery only
+# proposes these: a feeder from anywhere else cannot come back as a CX fare.
+CX_NETWORK = frozenset({
+    # Mainland China, Taiwan
+    "PEK", "PKX", "PVG", "CAN", "SZX", "CTU", "TFU", "CKG", "XMN", "FOC", "HGH", "NKG",
+    "WUH", "CSX", "KMG", "XIY", "TAO", "DLC", "CGO", "NGB", "TSN", "SYX", "TPE", "KHH",
+    # North and Southeast Asia
+    "NRT", "HND", "KIX", "NGO", "FUK", "CTS", "OKA", "ICN", "PUS", "MNL", "CEB", "SGN",
+    "HAN", "DAD", "BKK", "HKT", "SIN", "KUL", "PEN", "CGK", "DPS", "SUB", "RGN", "KTI",
+    # South Asia, Middle East, Africa
+    "DEL", "BOM", "BLR", "MAA", "HYD", "DAC", "KTM", "CMB", "MLE", "DXB", "RUH", "BAH",
+    "TLV", "JNB",
+    # Southwest Pacific
+    "SYD", "MEL", "BNE", "PER", "ADL", "CNS", "AKL", "CHC",
+    # Europe, North America
+    "LHR", "LGW", "MAN", "DUB", "CDG", "FRA", "MUC", "ZRH", "AMS", "BCN", "MAD", "FCO",
+    "MXP", "CPH", "BRU", "IST", "JFK", "BOS", "ORD", "DFW", "IAD", "LAX", "SFO", "SEA",
+    "YVR", "YYZ",
+})
+
+# Feeder sweep bounds
+MAX_FEEDER_ORIGINS = 40
+FEEDER_RESULTS_PER_BODY = 3
+
+# Feeder pre-pruning: NEW_ORIGIN→HUB→DEST is dropped when it is more than this many
+# times, or this many miles longer than, the great-circle NEW_ORIGIN→DEST distance.
+MAX_DETOUR_RATIO = 2.0
+MAX_ADDED_MILES = 3000
+
+# Amadeus Self-Service rate limits (transactions per second) and a typical call
+# latency, used for dry-run time estimates
+AMADEUS_RATE_LIMITS = {"test": 10.0, "production": 40.0}
+AVG_CALL_SECONDS = 1.0
+
+# 429s are account-wide throttling, not a broken route: retry after Retry-After
+# (or an exponential backoff from THROTTLE_BACKOFF_SECONDS) up to this many times
+THROTTLE_RETRIES = 3
+THROTTLE_BACKOFF_SECONDS = 1.0
+
+# HUB⇄DEST results fetched for a search session; any max_results up to this
+# (the GUI's ceiling) can then be served locally without another API call.
+SUPERSET_MAX_RESULTS = 100
+
 
 def parse_iso_duration(dur: str) -> int:
     m = ISO_DUR_RE.match(dur or "")
@@ -125,17 +191,421 @@ def estimate_earnings(seg_rows, earning_table, fare_type):
     return total_sp, total_am, per_seg
 
 
+_READ_CHUNK = 64 * 1024
+
+# Deadline (time.monotonic()) of the call_with_deadline() call running on this thread
+_DEADLINE = threading.local()
+
+
+def _deadline_timeout(timeout: float) -> float:
+    # Socket timeout for the next connect/send/recv: never past the current call's deadline
+    at = getattr(_DEADLINE, "at", None)
+    if at is None:
+        return timeout
+    left = at - time.monotonic()
+    if left <= 0:
+        raise socket.timeout("call deadline exceeded")
+    return min(timeout, left)
+
+
+class _BodyDecoder:
+    # Incremental gzip/deflate decoding for streamed response bodies
+    def __init__(self, encoding: str):
+        self.encoding = (encoding or "").strip().lower()
+        if self.encoding == "gzip":
+            self._d = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif self.encoding == "deflate":
+            self._d = zlib.decompressobj()
+        else:
+            self._d = None
+        self._started = False
+
+    def decode(self, chunk: bytes) -> bytes:
+        if self._d is None:
+            return chunk
+        try:
+            out = self._d.decompress(chunk)
+        except zlib.error:
+            if self._started or self.encoding != "deflate":
+                raise
+            # Some servers send raw deflate without the zlib header
+            self._d = zlib.decompressobj(-zlib.MAX_WBITS)
+            out = self._d.decompress(chunk)
+        self._started = True
+        return out
+
+    def flush(self) -> bytes:
+        return self._d.flush() if self._d is not None else b""
+
+
+class PooledResponse:
+    """
+    Streaming response from KeepAliveTransport.open().
+
+    read() returns decoded bytes as they arrive, so callers can parse incrementally.
+    close() drains whatever was left unread and hands the connection back to the pool.
+    """
+
+    def __init__(self, transport, key, conn, resp, url: str):
+        self.status = resp.status
+        self.code = resp.status
+        self.headers = resp.msg
+        self.url = url
+        self._transport = transport
+        self._key = key
+        self._conn = conn
+        self._resp = resp
+        self._decoder = _BodyDecoder(resp.msg.get("Content-Encoding"))
+        self._buf = b""
+        self._eof = False
+        self._broken = False
+        self.closed = False
+
+    def info(self):
+        return self.headers
+
+    def getheader(self, name, default=None):
+        return self.headers.get(name, default)
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            chunks = [self._buf]
+            while not self._eof:
+                chunks.append(self._next_chunk())
+            self._buf = b""
+            return b"".join(chunks)
+        while len(self._buf) < size and not self._eof:
+            self._buf += self._next_chunk()
+        out, self._buf = self._buf[:size], self._buf[size:]
+        return out
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            # Skip the rest without decoding it, so the socket is reusable
+            self._transport._set_timeout(self._conn, _deadline_timeout(self._transport.timeout))
+            while not self._broken and self._resp.read(_READ_CHUNK):
+                pass
+        except (http.client.HTTPException, OSError):
+            self._broken = True
+        if self._broken or self._resp.will_close:
+            self._conn.close()
+        else:
+            self._transport._release(self._key, self._conn)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _next_chunk(self) -> bytes:
+        try:
+            self._transport._set_timeout(self._conn, _deadline_timeout(self._transport.timeout))
+            raw = self._resp.read(_READ_CHUNK)
+        except (http.client.HTTPException, OSError):
+            self._broken = True
+            raise
+        if not raw:
+            self._eof = True
+            out = self._decoder.flush()
+        else:
+            out = self._decoder.decode(raw)
+        self._transport._count(len(raw), len(out))
+        return out
+
+
+class KeepAliveTransport:
+    """
+    Pooled keep-alive HTTP(S) transport, used as the Amadeus SDK's `http` option.
+
+    Drop-in for the SDK default (urllib's `urlopen`): it takes a urllib Request and
+    returns a response exposing status/info()/read(). Idle connections are kept per
+    (scheme, host, port) so a sweep pays for one TLS handshake instead of one per call,
+    and gzip/deflate bodies are requested and decoded transparently.
+    """
+
+    def __init__(self, max_idle_per_host: int = 8, timeout: float = 60.0):
+        self.max_idle_per_host = max_idle_per_host
+        self.timeout = timeout
+        self._idle = {}
+        self._lock = threading.Lock()
+        self.stats = {"requests": 0, "connections": 0, "bytes_wire": 0, "bytes_decoded": 0}
+
+    def __call__(self, request, timeout=None):
+        resp = self.open(request, timeout)
+        try:
+            body = resp.read()
+        except (http.client.HTTPException, OSError) as e:
+            raise URLError(e)
+        finally:
+            resp.close()
+
+        msg = resp.headers
+        if resp._decoder.encoding in {"gzip", "deflate"}:
+            del msg["Content-Encoding"]
+            del msg["Content-Length"]
+        return addinfourl(io.BytesIO(body), msg, request.full_url, resp.status)
+
+    def open(self, request, timeout=None) -> PooledResponse:
+        """
+        Sends the request and returns once headers are in; the body is left on the
+        wire for the caller to stream via PooledResponse.read().
+        """
+        parts = urlsplit(request.full_url)
+        scheme = (parts.scheme or "https").lower()
+        key = (scheme, parts.hostname, parts.port or (443 if scheme == "https" else 80))
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+
+        headers = dict(request.header_items())
+        headers.setdefault("Accept-Encoding", "gzip, deflate")
+        headers["Connection"] = "keep-alive"
+        method = request.get_method()
+
+        for attempt in (0, 1):
+            try:
+                # Inside call_with_deadline() the socket gives up at the call's deadline,
+                # so an abandoned call does not hold its thread for the full timeout
+                conn_timeout = _deadline_timeout(timeout or self.timeout)
+            except OSError as e:
+                raise URLError(e)
+            conn, reused = self._acquire(key, conn_timeout)
+            try:
+                conn.request(method, path, body=request.data, headers=headers)
+                resp = conn.getresponse()
+            except (http.client.HTTPException, OSError) as e:
+                conn.close()
+                # A pooled socket may have been closed by the server while idle;
+                # retry once on a fresh connection before giving up.
+                if reused and attempt == 0:
+                    continue
+                raise URLError(e)
+            break
+
+        with self._lock:
+            self.stats["requests"] += 1
+        return PooledResponse(self, key, conn, resp, request.full_url)
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+    def _count(self, wire: int, decoded: int):
+        with self._lock:
+            self.stats["bytes_wire"] += wire
+            self.stats["bytes_decoded"] += decoded
+
+    def _acquire(self, key, timeout=None):
+        with self._lock:
+            conns = self._idle.get(key)
+            conn = conns.pop() if conns else None
+            if conn is None:
+                self.stats["connections"] += 1
+        if conn is not None:
+            self._set_timeout(conn, timeout or self.timeout)
+            return conn, True
+        scheme, host, port = key
+        conn_cls = http.client.HTTPSConnection if scheme == "https" else http.client.HTTPConnection
+        return conn_cls(host, port, timeout=timeout or self.timeout), False
+
+    @staticmethod
+    def _set_timeout(conn, timeout: float):
+        conn.timeout = timeout
+        if conn.sock is not None:
+            conn.sock.settimeout(timeout)
+
+    def _release(self, key, conn):
+        with self._lock:
+            conns = self._idle.setdefault(key, [])
+            if len(conns) < self.max_idle_per_host:
+                conns.append(conn)
+                return
+        conn.close()
+
+
+# Shared by every Amadeus client created through amadeus_client()
+HTTP_TRANSPORT = KeepAliveTransport()
+
+_CLIENTS = {}
+_CLIENTS_LOCK = threading.Lock()
+
+
 def amadeus_client(client_id: str, client_secret: str, hostname: str = None):
-    kwargs = {"client_id": client_id, "client_secret": client_secret}
-    if hostname:
-        kwargs["hostname"] = hostname  # "production"
-    return Client(**kwargs)
+    # Clients are cached per credentials/host so the access token and the pooled
+    # connections are reused across calls instead of rebuilt for every search.
+    key = (client_id, client_secret, hostname)
+    with _CLIENTS_LOCK:
+        am = _CLIENTS.get(key)
+        if am is None:
+            kwargs = {"client_id": client_id, "client_secret": client_secret, "http": HTTP_TRANSPORT}
+            if hostname and "://" in hostname:
+                # Explicit base URL, e.g. a local stand-in server "http://127.0.0.1:8080"
+                parts = urlsplit(hostname)
+                ssl = parts.scheme == "https"
+                kwargs.update(host=parts.hostname, ssl=ssl, port=parts.port or (443 if ssl else 80))
+            elif hostname:
+                kwargs["hostname"] = hostname  # "production"
+            am = Client(**kwargs)
+            _CLIENTS[key] = am
+    return am
 
 
+@functools.lru_cache(maxsize=1)
 def load_airports():
+    # Loaded once per process; callers treat it as read-only
     return airportsdata.load("IATA")
 
 
+EARTH_RADIUS_MILES = 3958.7613
+
+# airportsdata has no schedule data; these name markers and a non-ICAO ident
+# (e.g. FAA-style "07FA") only weed out obvious non-airports (about 5% of records).
+_NON_SCHEDULED_MARKERS = ("HELIPORT", "SEAPLANE", "AIR BASE", "AIR FORCE", "ARMY", "NAVAL", "MILITARY")
+
+
+def likely_scheduled_service(rec: dict) -> bool:
+    icao = rec.get("icao") or ""
+    if len(icao) != 4 or not icao.isalpha():
+        return False
+    name = (rec.get("name") or "").upper()
+    return not any(m in name for m in _NON_SCHEDULED_MARKERS)
+
+
+def _unit_vector(lat: float, lon: float):
+    phi = math.radians(lat)
+    lam = math.radians(lon)
+    return math.cos(phi) * math.cos(lam), math.cos(phi) * math.sin(lam), math.sin(phi)
+
+
+class AirportIndex:
+    """
+    Lat/lon grid over airport coordinates for radius and nearest-N queries.
+
+    Each cell holds (code, unit vector, country, scheduled) tuples, so a query only
+    visits the cells overlapping its bounding box and compares candidates with a dot
+    product instead of running haversine over every airport record.
+    """
+
+    def __init__(self, airports, cell_deg: float = 2.0):
+        self.cell_deg = cell_deg
+        self._n_lat = int(math.ceil(180.0 / cell_deg))
+        self._n_lon = int(math.ceil(360.0 / cell_deg))
+        self._cells = {}
+        self._points = {}
+        for code, rec in airports.items():
+            lat, lon = rec.get("lat"), rec.get("lon")
+            if lat is None or lon is None:
+                continue
+            entry = (code, _unit_vector(lat, lon), (rec.get("country") or "").upper(), likely_scheduled_service(rec))
+            self._points[code] = (lat, lon)
+            self._cells.setdefault(self._cell(lat, lon), []).append(entry)
+
+    def __len__(self):
+        return len(self._points)
+
+    def _cell(self, lat: float, lon: float):
+        i = min(self._n_lat - 1, int((lat + 90.0) // self.cell_deg))
+        j = int((lon + 180.0) // self.cell_deg) % self._n_lon
+        return i, j
+
+    def _cells_for(self, lat: float, lon: float, ang: float):
+        # Bounding box of a spherical cap; a cap over a pole or wider than a
+        # hemisphere in longitude covers every longitude cell.
+        lat_lo = lat - math.degrees(ang)
+        lat_hi = lat + math.degrees(ang)
+        i_lo = self._cell(max(-90.0, lat_lo), 0.0)[0]
+        i_hi = self._cell(min(90.0, lat_hi), 0.0)[0]
+        s = math.sin(ang) / max(1e-12, math.cos(math.radians(lat)))
+        if lat_lo <= -90.0 or lat_hi >= 90.0 or s >= 1.0:
+            js = range(self._n_lon)
+        else:
+            dlon = math.degrees(math.asin(s))
+            j_lo = int((lon - dlon + 180.0) // self.cell_deg)
+            j_hi = int((lon + dlon + 180.0) // self.cell_deg)
+            js = [j % self._n_lon for j in range(j_lo, j_hi + 1)]
+            if len(js) > self._n_lon:
+                js = range(self._n_lon)
+        for i in range(i_lo, i_hi + 1):
+            for j in js:
+                yield i, j
+
+    def within(self, center, radius_miles: float, countries=None, scheduled_only: bool = True,
+               only=None) -> list:
+        """
+        Airports within radius_miles of `center` (an IATA code or (lat, lon)),
+        as [(code, miles), ...] nearest first, optionally limited to the codes in `only`.
+        The center airport itself is left out.
+        """
+        if isinstance(center, str):
+            if center not in self._points:
+                return []
+            lat, lon = self._points[center]
+        else:
+            lat, lon = center
+        cx, cy, cz = _unit_vector(lat, lon)
+        ang = min(math.pi, radius_miles / EARTH_RADIUS_MILES)
+        min_dot = math.cos(ang)
+        wanted = {c.upper() for c in countries} if countries else None
+
+        found = []
+        for cell in self._cells_for(lat, lon, ang):
+            for code, (x, y, z), country, scheduled in self._cells.get(cell, ()):
+                if scheduled_only and not scheduled:
+                    continue
+                if wanted is not None and country not in wanted:
+                    continue
+                if only is not None and code not in only:
+                    continue
+                dot = cx * x + cy * y + cz * z
+                if dot >= min_dot and code != center:
+                    found.append((code, EARTH_RADIUS_MILES * math.acos(min(1.0, dot))))
+        found.sort(key=lambda t: t[1])
+        return found
+
+    def nearest(self, center, n: int, countries=None, scheduled_only: bool = True, max_miles: float = None,
+                only=None) -> list:
+        """The n airports nearest `center`, as [(code, miles), ...]; widens the radius until it has them."""
+        radius = 250.0
+        limit = max_miles or math.pi * EARTH_RADIUS_MILES
+        while True:
+            radius = min(radius, limit)
+            found = self.within(center, radius, countries, scheduled_only, only)
+            if len(found) >= n or radius >= limit:
+                return found[:n]
+            radius *= 2
+
+
+@functools.lru_cache(maxsize=1)
+def airport_index() -> AirportIndex:
+    # Built once per process from load_airports()
+    return AirportIndex(load_airports())
+
+
+def discover_feeder_origins(hub: str, radius_miles: float = None, n: int = None, countries=None,
+                            network=CX_NETWORK) -> list:
+    """
+    Feeder candidates around any HUB from airport coordinates instead of NEW_ORIGIN_POOLS:
+    every `network` airport (CX_NETWORK unless given; None for any airport) within
+    radius_miles, or the n nearest (optionally both, and optionally limited to some
+    country codes), nearest first.
+    """
+    index = airport_index()
+    if n:
+        found = index.nearest(hub, n, countries, max_miles=radius_miles, only=network)
+    elif radius_miles:
+        found = index.within(hub, radius_miles, countries, only=network)
+    else:
+        return []
+    return [code for code, _ in found]
+
+
 def compute_offer_metrics(offer: dict, airports):
     total_minutes = 0
     total_miles = 0.0
@@ -213,6 +683,25 @@ def is_roundtrip_nonstop(offer: dict) -> bool:
     return all(len(it.get("segments", []) or []) == 1 for it in its[:2])
 
 
+class ThrottledError(RuntimeError):
+    """Amadeus answered 429; retry_after is its Retry-After in seconds, if it sent one."""
+
+    def __init__(self, message: str, retry_after=None):
+        super().__init__(message)
+        try:
+            self.retry_after = float(retry_after) if retry_after is not None else None
+        except ValueError:  # HTTP-date form
+            self.retry_after = None
+
+
+def _api_error(e: ResponseError) -> RuntimeError:
+    resp = e.response
+    if getattr(resp, "status_code", None) == 429:
+        headers = getattr(getattr(resp, "http_response", None), "headers", None) or {}
+        return ThrottledError(f"Amadeus API error: {e}", headers.get("Retry-After"))
+    return RuntimeError(f"Amadeus API error: {e}")
+
+
 def search_roundtrip_get(
     client_id: str,
     client_secret: str,
@@ -255,7 +744,7 @@ def search_roundtrip_get(
         resp = am.shopping.flight_offers_search.get(**params)
         return resp.data
     except ResponseError as e:
-        raise RuntimeError(f"Amadeus API error: {e}")
+        raise _api_error(e)
 
 
 def _date_add(date_str: str, days: int) -> str:
@@ -296,12 +785,65 @@ def search_multicity_post(
     if tc != "ANY":
         body["searchCriteria"]["travelClass"] = tc
 
+    # Ask Amadeus for no more than we keep, and stream-parse in case it sends more anyway
+    body["searchCriteria"]["maxFlightOffers"] = max(1, min(int(max_results), MAX_FLIGHT_OFFERS))
+
     try:
-        resp = am.shopping.flight_offers_search.post(body)
-        data = resp.data or []
-        return data[:max_results]
+        return _stream_flight_offers_post(am, body, max_results)
     except ResponseError as e:
-        raise RuntimeError(f"Amadeus API error: {e}")
+        raise _api_error(e)
+    except (http.client.HTTPException, OSError) as e:
+        raise RuntimeError(f"Amadeus API error: [network] {e}")
+
+
+def read_offers(fp, limit: int) -> list:
+    """
+    Reads up to `limit` offers from a Flight Offers response body.
+
+    With ijson the "data" array is parsed one offer at a time and parsing stops once
+    `limit` offers are in hand, so memory and parse time follow what we keep rather
+    than the full response. Without ijson the whole body is loaded and sliced.
+    """
+    if ijson is None:
+        return (json.load(fp).get("data") or [])[:limit]
+    return list(itertools.islice(ijson.items(fp, "data.item", use_float=True), limit))
+
+
+def _bearer_token(am) -> str:
+    # Same memoized AccessToken the SDK uses for its own calls on this client
+    if not hasattr(am, "access_token"):
+        am.access_token = AccessToken(am)
+    return am.access_token._bearer_token()
+
+
+def _api_url(am, path: str) -> str:
+    url = f"{'https' if am.ssl else 'http'}://{am.host}"
+    if int(am.port) != (443 if am.ssl else 80):
+        url += f":{am.port}"
+    return url + path
+
+
+def _stream_flight_offers_post(am, body: dict, max_results: int) -> list:
+    # Raw POST through the pooled transport so the body can be streamed; the SDK's
+    # own response parser always reads and decodes the whole payload first.
+    req = Request(
+        _api_url(am, FLIGHT_OFFERS_PATH),
+        data=json.dumps(body).encode(),
+        method="POST",
+        headers={
+            "Authorization": _bearer_token(am),
+            "Accept": "application/json, application/vnd.amadeus+json",
+            "Content-Type": "application/vnd.amadeus+json",
+            "X-HTTP-Method-Override": "GET",
+        },
+    )
+    with am.http.open(req) as resp:
+        if resp.status >= 400:
+            detail = resp.read().decode("utf-8", "replace")
+            if resp.status == 429:
+                raise ThrottledError(f"Amadeus API error: [429] {detail}", resp.getheader("Retry-After"))
+            raise RuntimeError(f"Amadeus API error: [{resp.status}] {detail}")
+        return read_offers(resp, max_results)
 
 
 def build_new_origin_via_hub_bodies(new_origin: str, hub: str, dest: str, hub_depart_date: str, hub_return_date: str):
@@ -342,4 +884,516 @@ def expand_new_origins(selected_regions: list) -> list:
     airports = []
     for r in selected_regions:
         airports.extend(NEW_ORIGIN_POOLS.get(r, []))
-    return sorted(set(airports))
\ No newline at end of file
+    return sorted(set(airports))
+
+
+def airport_distance_miles(a: str, b: str, airports):
+    arec = airports.get(a)
+    brec = airports.get(b)
+    if not arec or not brec:
+        return None
+    return haversine_miles(arec["lat"], arec["lon"], brec["lat"], brec["lon"])
+
+
+def feeder_detour(new_origin: str, hub: str, dest: str, airports):
+    """
+    Returns (detour_ratio, added_miles) of NEW_ORIGIN→HUB→DEST against flying
+    NEW_ORIGIN→DEST directly, or None when an airport has no coordinates.
+    """
+    leg1 = airport_distance_miles(new_origin, hub, airports)
+    leg2 = airport_distance_miles(hub, dest, airports)
+    direct = airport_distance_miles(new_origin, dest, airports)
+    if leg1 is None or leg2 is None or direct is None:
+        return None
+    via = leg1 + leg2
+    ratio = via / direct if direct > 0 else math.inf
+    return ratio, via - direct
+
+
+def prune_feeder_origins(candidates: list, hub: str, dest: str, airports,
+                         max_detour_ratio: float = MAX_DETOUR_RATIO, max_added_miles: float = MAX_ADDED_MILES):
+    """
+    Drops feeder origins whose detour through HUB is hopeless for DEST (e.g. KHH→HKG→TPE)
+    and orders the rest by detour ratio, so any cap keeps the most sensible ones.
+    Origins without coordinates are kept, last. Returns (kept, {origin: reason}).
+    """
+    scored = []
+    unknown = []
+    pruned = {}
+    for o in candidates:
+        d = feeder_detour(o, hub, dest, airports)
+        if d is None:
+            unknown.append(o)
+            continue
+        ratio, added = d
+        if ratio > max_detour_ratio or added > max_added_miles:
+            pruned[o] = f"detour x{ratio:.1f}, +{added:.0f} mi via {hub}"
+            continue
+        scored.append((ratio, o))
+    scored.sort()
+    return [o for _, o in scored] + unknown, pruned
+
+
+def offer_price(offer: dict) -> float:
+    try:
+        return float(offer.get("price", {}).get("grandTotal", "1e18"))
+    except Exception:
+        return 1e18
+
+
+# Runs calls that have a deadline or a hedge; a timed-out call keeps its worker
+# until its socket notices the deadline, so this is sized for some stragglers.
+_CALL_POOL = ThreadPoolExecutor(max_workers=32, thread_name_prefix="amadeus-call")
+
+
+def call_with_deadline(fn, timeout: float = None, hedge_after: float = None):
+    """
+    Runs fn() with an overall deadline and an optional hedged duplicate.
+
+    If no answer has arrived after `hedge_after` seconds, the same call is issued once
+    more and whichever finishes first wins. If nothing succeeds within `timeout`
+    seconds, a RuntimeError is raised; the straggler's socket times out at the same
+    deadline (see _deadline_timeout()), so it does not outlive the call by long.
+    With neither set, fn() is simply called inline.
+    """
+    if not timeout and not hedge_after:
+        return fn()
+
+    start = time.monotonic()
+
+    def bounded():
+        _DEADLINE.at = start + timeout if timeout else None
+        try:
+            return fn()
+        finally:
+            _DEADLINE.at = None
+
+    pending = [_CALL_POOL.submit(bounded)]
+    hedged = not hedge_after
+    last_exc = None
+
+    while pending:
+        waits = []
+        if timeout:
+            waits.append(start + timeout - time.monotonic())
+        if not hedged:
+            waits.append(start + hedge_after - time.monotonic())
+        wait_for = max(0.0, min(waits)) if waits else None
+        done, _ = wait(pending, timeout=wait_for, return_when=FIRST_COMPLETED)
+
+        for f in done:
+            pending.remove(f)
+            if f.exception() is None:
+                for other in pending:
+                    other.cancel()
+                return f.result()
+            last_exc = f.exception()
+
+        elapsed = time.monotonic() - start
+        if timeout and elapsed >= timeout:
+            for other in pending:
+                other.cancel()
+            raise RuntimeError(f"Amadeus API error: [timeout] no response within {timeout:g}s")
+        if not hedged and pending and elapsed >= hedge_after:
+            pending.append(_CALL_POOL.submit(bounded))
+            hedged = True
+
+    raise last_exc
+
+
+API_ERROR_RE = re.compile(r"\[(\d{3}|network|timeout)\]")
+
+
+def is_route_failure(exc: Exception) -> bool:
+    # 4xx answers (bad DEST, dates in the past, ...) are about the request and 429 is
+    # account-wide throttling (retried in run_search_call()), not about the route;
+    # only 5xx, network errors and timeouts say the route is unhealthy
+    m = API_ERROR_RE.search(str(exc))
+    if m and m.group(1).isdigit():
+        status = int(m.group(1))
+        return status >= 500 or status == 408
+    return True
+
+
+def breaker_key(call: dict):
+    # A planned call's route within one search (same DEST and HUB dates)
+    return call["route"], call["dest"], call["depart_date"], call["return_date"]
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker for the search sweep, keyed by breaker_key().
+
+    After `failure_threshold` consecutive failures a key is open and skipped. Once
+    `reset_after` seconds have passed, one trial call is let through; success closes the
+    key again, failure re-opens it for another `reset_after`. Callers only record
+    failures for which is_route_failure() holds.
+    """
+
+    def __init__(self, failure_threshold: int = 2, reset_after: float = 300.0):
+        self.failure_threshold = failure_threshold
+        self.reset_after = reset_after
+        self._failures = {}
+        self._opened_at = {}
+        self._lock = threading.Lock()
+
+    def allow(self, key) -> bool:
+        with self._lock:
+            opened = self._opened_at.get(key)
+            if opened is None:
+                return True
+            if time.monotonic() - opened >= self.reset_after:
+                # Half-open: let this call through, hold the rest until it reports back
+                self._opened_at[key] = time.monotonic()
+                return True
+            return False
+
+    def record_success(self, key):
+        with self._lock:
+            self._failures.pop(key, None)
+            self._opened_at.pop(key, None)
+
+    def record_failure(self, key):
+        with self._lock:
+            n = self._failures.get(key, 0) + 1
+            self._failures[key] = n
+            if n >= self.failure_threshold:
+                self._opened_at[key] = time.monotonic()
+
+
+class RateLimiter:
+    """
+    Token bucket shared by concurrent callers: acquire() blocks until a call may start,
+    so several workers together stay under `rate` calls per second.
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1.0:
+                    self._tokens -= 1.0
+                    return
+                delay = (1.0 - self._tokens) / self.rate
+            time.sleep(delay)
+
+
+def _feeder_body_rank(ods: list, depart_date: str, return_date: str) -> int:
+    # Same-day connections both ways first, then an earlier feeder, then a later return
+    feeder_same_day = ods[0]["departureDateTimeRange"]["date"] == depart_date
+    back_same_day = ods[-1]["departureDateTimeRange"]["date"] == return_date
+    return (0 if feeder_same_day else 1) + (0 if back_same_day else 2)
+
+
+def plan_search_calls(
+    hub: str,
+    dest: str,
+    depart_date: str,
+    return_date: str,
+    regions=(),
+    enable_feeders: bool = True,
+    max_detour_ratio: float = MAX_DETOUR_RATIO,
+    max_added_miles: float = MAX_ADDED_MILES,
+    call_budget: int = None,
+    feeder_radius_miles: float = None,
+    feeder_nearest: int = None,
+    feeder_countries=None,
+):
+    """
+    The exact list of Amadeus calls fetch_search_superset() will make, without making any.
+
+    Without a budget this is the HUB⇄DEST call plus every feeder body for the first
+    MAX_FEEDER_ORIGINS origins left after pruning. With `call_budget`, all pruned-in
+    origins are considered and calls are taken by value: HUB⇄DEST first, then each
+    origin's best body (lowest detour first), then second-best bodies, and so on.
+
+    Feeder origins come from the region pools, plus any airports found around the HUB
+    with feeder_radius_miles / feeder_nearest / feeder_countries (see discover_feeder_origins()).
+    """
+    calls = [{"kind": "direct", "route": f"{hub}⇄{dest}", "hub": hub, "dest": dest,
+              "depart_date": depart_date, "return_date": return_date}]
+    pruned = {}
+    if enable_feeders:
+        candidates = set(expand_new_origins(list(regions)))
+        if feeder_radius_miles or feeder_nearest:
+            candidates.update(discover_feeder_origins(hub, feeder_radius_miles, feeder_nearest, feeder_countries))
+        candidates = [o for o in sorted(candidates) if o not in {hub, dest}]
+        candidates, pruned = prune_feeder_origins(candidates, hub, dest, load_airports(),
+                                                  max_detour_ratio, max_added_miles)
+        if call_budget is None:
+            # Bound the search (can be increased)
+            candidates = candidates[:MAX_FEEDER_ORIGINS]
+
+        feeder_calls = []
+        for detour_rank, new_origin in enumerate(candidates):
+            for ods in build_new_origin_via_hub_bodies(new_origin, hub, dest, depart_date, return_date):
+                feeder_calls.append({
+                    "kind": "feeder",
+                    "route": f"{new_origin}→{hub}",
+                    "new_origin": new_origin,
+                    "dest": dest,
+                    "depart_date": depart_date,
+                    "return_date": return_date,
+                    "ods": ods,
+                    "priority": (_feeder_body_rank(ods, depart_date, return_date), detour_rank),
+                })
+        if call_budget is not None:
+            feeder_calls.sort(key=lambda c: c["priority"])
+        calls.extend(feeder_calls)
+
+    dropped = 0
+    if call_budget is not None and len(calls) > call_budget:
+        dropped = len(calls) - max(0, call_budget)
+        calls = calls[:max(0, call_budget)]
+
+    return {"calls": calls, "pruned": pruned, "dropped_by_budget": dropped}
+
+
+def estimate_plan_seconds(n_calls: int, hostname: str = None, avg_call_seconds: float = AVG_CALL_SECONDS,
+                          workers: int = 1, rate: float = None) -> float:
+    """
+    Time for n_calls made by `workers` concurrent callers: each caller manages one call
+    per avg_call_seconds, and all of them together no more than `rate` calls per second
+    (the environment's rate limit unless given). The single-threaded sweep is latency
+    bound; the limit only comes into play with enough workers (see cathay_batch).
+    """
+    if rate is None:
+        rate = AMADEUS_RATE_LIMITS.get(hostname or "test", AMADEUS_RATE_LIMITS["test"])
+    return n_calls / min(rate, workers / avg_call_seconds)
+
+
+def describe_plan(plan: dict, hostname: str = None, avg_call_seconds: float = AVG_CALL_SECONDS) -> dict:
+    calls = plan["calls"]
+    feeder_calls = [c for c in calls if c["kind"] == "feeder"]
+    return {
+        "calls": len(calls),
+        "direct_calls": len(calls) - len(feeder_calls),
+        "feeder_calls": len(feeder_calls),
+        "feeder_origins": len({c["new_origin"] for c in feeder_calls}),
+        "pruned_origins": len(plan["pruned"]),
+        "dropped_by_budget": plan["dropped_by_budget"],
+        "estimated_seconds": estimate_plan_seconds(len(calls), hostname, avg_call_seconds),
+    }
+
+
+def fetch_search_superset(
+    client_id: str,
+    client_secret: str,
+    hub: str,
+    dest: str,
+    depart_date: str,
+    return_date: str,
+    adults: int,
+    currency: str,
+    travel_class: str = "ANY",
+    regions=(),
+    enable_feeders: bool = True,
+    hostname: str = None,
+    call_timeout: float = None,
+    hedge_after: float = None,
+    breaker: CircuitBreaker = None,
+    max_detour_ratio: float = MAX_DETOUR_RATIO,
+    max_added_miles: float = MAX_ADDED_MILES,
+    call_budget: int = None,
+    feeder_radius_miles: float = None,
+    feeder_nearest: int = None,
+    feeder_countries=None,
+    plan: dict = None,
+):
+    """
+    Runs the upstream part of a search and keeps everything it returns, before any
+    client-side filter (CX only, non-stop preference, max_results) is applied.
+
+    Only the parameters here change what Amadeus sends back; filters are applied
+    afterwards on the enriched results (cathay_table.apply_result_filters()), so they
+    can change without new API calls.
+
+    A failing call never aborts the sweep: each call is bounded by call_with_deadline()
+    and routes that keep failing are skipped by `breaker` (a fresh one per sweep unless
+    given). Failures are returned per route under "errors", alongside partial results.
+
+    Feeder origins are pre-pruned by detour geometry before any call is made (see
+    prune_feeder_origins()); the dropped ones are returned under "pruned". The calls
+    made are exactly those of plan_search_calls(), so `call_budget` is a hard cap:
+    hedging is turned off when a budget is set, as each hedge is one more call.
+    A caller that already built the plan (e.g. to print it) passes it as `plan`.
+    """
+    if breaker is None:
+        breaker = CircuitBreaker()
+    if call_budget is not None:
+        hedge_after = None
+    errors = {}
+
+    def guarded(call, fn):
+        route, key = call["route"], breaker_key(call)
+        if not breaker.allow(key):
+            errors.setdefault(route, []).append("skipped: circuit open after repeated failures")
+            return None
+        try:
+            result = call_with_deadline(fn, call_timeout, hedge_after)
+        except Exception as e:
+            if is_route_failure(e):
+                breaker.record_failure(key)
+            errors.setdefault(route, []).append(str(e))
+            return None
+        breaker.record_success(key)
+        return result
+
+    if plan is None:
+        plan = plan_search_calls(hub, dest, depart_date, return_date, regions, enable_feeders,
+                                 max_detour_ratio, max_added_miles, call_budget,
+                                 feeder_radius_miles, feeder_nearest, feeder_countries)
+
+    results = []
+    for call in plan["calls"]:
+        results.append(guarded(call, lambda call=call: run_search_call(
+            call, client_id, client_secret, adults, currency, travel_class, hostname)) or [])
+
+    superset = collect_search_results(plan, results)
+    superset["errors"] = errors
+    return superset
+
+
+def run_search_call(call: dict, client_id: str, client_secret: str, adults: int, currency: str,
+                    travel_class: str = "ANY", hostname: str = None) -> list:
+    """
+    Makes the one Amadeus call a plan_search_calls() entry stands for. A 429 is retried
+    after Retry-After (or a backoff), unless that would run past the call's deadline.
+    """
+    for attempt in range(THROTTLE_RETRIES + 1):
+        try:
+            return _search_call_once(call, client_id, client_secret, adults, currency, travel_class, hostname)
+        except ThrottledError as e:
+            delay = e.retry_after if e.retry_after is not None else THROTTLE_BACKOFF_SECONDS * 2 ** attempt
+            at = getattr(_DEADLINE, "at", None)
+            if attempt == THROTTLE_RETRIES or (at is not None and time.monotonic() + delay >= at):
+                raise
+            time.sleep(delay)
+
+
+def _search_call_once(call: dict, client_id: str, client_secret: str, adults: int, currency: str,
+                      travel_class: str, hostname: str) -> list:
+    if call["kind"] == "direct":
+        return search_roundtrip_get(
+            client_id=client_id,
+            client_secret=client_secret,
+            origin=call["hub"],
+            dest=call["dest"],
+            depart_date=call["depart_date"],
+            return_date=call["return_date"],
+            adults=adults,
+            currency=currency,
+            max_results=call.get("max_results", SUPERSET_MAX_RESULTS),
+            hostname=hostname,
+            travel_class=travel_class,
+            non_stop=call.get("non_stop", False),
+        )
+    return search_multicity_post(
+        client_id=client_id,
+        client_secret=client_secret,
+        origin_destinations=call["ods"],
+        adults=adults,
+        currency=currency,
+        max_results=FEEDER_RESULTS_PER_BODY,
+        hostname=hostname,
+        travel_class=travel_class
+    )
+
+
+def search_call_key(call: dict, adults: int, currency: str, travel_class: str = "ANY", hostname: str = None):
+    """Identity of the request behind a planned call; equal keys mean the same Amadeus response."""
+    if call["kind"] == "direct":
+        what = (call["hub"], call["dest"], call["depart_date"], call["return_date"],
+                call.get("max_results", SUPERSET_MAX_RESULTS), call.get("non_stop", False))
+    else:
+        what = json.dumps(call["ods"], sort_keys=True)
+    return call["kind"], what, adults, currency, travel_class, hostname
+
+
+def offer_fingerprint(offer: dict) -> tuple:
+    # Amadeus numbers offers 1, 2, 3... per response, so the offer id only identifies an
+    # offer within one call; across calls compare the flights, their times and the price
+    flights = tuple(
+        (s.get("carrierCode"), s.get("number"), (s.get("departure") or {}).get("at"))
+        for it in offer.get("itineraries") or [] for s in it.get("segments") or []
+    )
+    return flights, (offer.get("price") or {}).get("grandTotal")
+
+
+def collect_search_results(plan: dict, results: list) -> dict:
+    """
+    Builds a superset (see fetch_search_superset()) from a plan and the offers each of
+    its calls returned (same order; [] for a failed call). "errors" is left to the caller.
+    """
+    direct = []
+    feeders = []
+    seen = set()
+    for call, offers in zip(plan["calls"], results):
+        if call["kind"] == "direct":
+            direct = offers
+            continue
+        new_origin = call["new_origin"]
+        for o in offers:
+            key = (new_origin, offer_fingerprint(o))
+            if key in seen:
+                continue
+            seen.add(key)
+            feeders.append((new_origin, o))
+
+    return {"direct": direct, "feeders": feeders, "errors": {}, "pruned": plan["pruned"],
+            "calls": len(plan["calls"]), "dropped_by_budget": plan["dropped_by_budget"]}
+
+
+def summarize_search_errors(errors: dict) -> list:
+    # One line per failing route: "KHH→HKG: 1 failed, 3 skipped (last: ...)"
+    lines = []
+    for route, msgs in sorted(errors.items()):
+        skipped = sum(1 for m in msgs if m.startswith("skipped:"))
+        failed = [m for m in msgs if not m.startswith("skipped:")]
+        parts = []
+        if failed:
+            parts.append(f"{len(failed)} failed")
+        if skipped:
+            parts.append(f"{skipped} skipped")
+        last = f" (last: {failed[-1]})" if failed else ""
+        lines.append(f"{route}: {', '.join(parts)}{last}")
+    return lines
+
+
+def enrich_offer(kind: str, new_origin: str, via_hub: str, offer: dict, airports, earning_table: dict,
+                 currency: str, travel_class: str) -> dict:
+    price = offer.get("price", {}).get("grandTotal")
+    cur = offer.get("price", {}).get("currency", currency)
+    total_min, total_miles, segs = compute_offer_metrics(offer, airports)
+
+    fare_type = infer_fare_type_from_offer(offer).upper()
+    if fare_type not in {"LIGHT", "ESSENTIAL", "FLEX"}:
+        fare_type = "UNKNOWN"
+
+    est_sp, est_am, _ = estimate_earnings(segs, earning_table, fare_type)
+    stops = count_stops_all_itineraries(offer)
+
+    return {
+        "type": kind,
+        "new_origin": new_origin,
+        "via_hub": via_hub,
+        "price_amount": price,
+        "currency": cur,
+        "total_minutes": total_min,
+        "stops": stops,
+        "travel_class_filter": travel_class,
+        "cx_only": offer_is_all_cx(offer),
+        "estimated_sp": est_sp,
+        "estimated_am": est_am,
+        "segments": segs,
+        "raw_offer": offer
+    }
\ No newline at end of file
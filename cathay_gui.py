@@ -3,14 +3,22 @@ import os
 import sys
 import json
 import threading
+import time
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
 
+import yaml
+
+import cathay_alerts
 import cathay_core as core
+import cathay_table
 
 APP_NAME = "CathayPriceChecker"
 DEFAULT_EARNINGS = "cathay_earnings.yaml"
 
+# Search reuses the last sweep for the same inputs only while it is this fresh
+SESSION_MAX_AGE_SECONDS = 10 * 60
+
 
 def appdata_dir():
     base = os.getenv("APPDATA") or os.path.expanduser("~")
@@ -55,10 +63,27 @@ class App(tk.Tk):
 
         self.cfg = load_config()
         self.airports = core.load_airports()
+        self.alerts = self._load_alerts()
 
         self._build_ui()
         self._load_defaults()
 
+    def _load_alerts(self):
+        # Price alerts are optional: only active when the subscriptions file has entries,
+        # and a broken file disables them instead of stopping the app from starting
+        path = self.cfg.get("alerts_yaml") or os.path.join(appdata_dir(), "alerts.yaml")
+        try:
+            subs = cathay_alerts.load_subscriptions(path)
+            if not subs:
+                return None
+            sinks = [cathay_alerts.FileSink(self.cfg.get("alerts_log") or os.path.join(appdata_dir(), "alerts.jsonl"))]
+            if self.cfg.get("alerts_webhook"):
+                sinks.append(cathay_alerts.WebhookSink(self.cfg["alerts_webhook"]))
+            return cathay_alerts.AlertEngine(subs, sinks)
+        except (yaml.YAMLError, OSError, ValueError, TypeError, AttributeError) as e:
+            messagebox.showwarning("Price alerts disabled", f"{path}:\n{e}")
+            return None
+
     def _build_ui(self):
         pad = {"padx": 8, "pady": 6}
 
@@ -157,6 +182,7 @@ class App(tk.Tk):
         actions.pack(fill="x", **pad)
         ttk.Button(actions, text="Search (HUB⇄DEST direct first, then feeder origins via HUB)", command=self.on_search)\
             .pack(side="left")
+        ttk.Button(actions, text="Estimate calls", command=self.on_estimate).pack(side="left", padx=8)
         ttk.Button(actions, text="Export JSON…", command=self.export_json).pack(side="left", padx=8)
         self.status_var = tk.StringVar(value="Ready.")
         ttk.Label(actions, textvariable=self.status_var).pack(side="left", padx=12)
@@ -192,6 +218,13 @@ class App(tk.Tk):
         self.details_text.pack(fill="both", expand=True, padx=8, pady=6)
 
         self.results = []
+        self.session = None
+        self._searching = False
+        # Routes that keep failing are skipped across searches until they cool down
+        self.breaker = core.CircuitBreaker()
+
+        for v in (self.strict_cx_var, self.nonstop_direct_var, self.max_var):
+            v.trace_add("write", self._on_filter_change)
 
     def _load_defaults(self):
         self.hub_var.set(self.cfg.get("hub", "HKG"))
@@ -268,143 +301,169 @@ class App(tk.Tk):
             messagebox.showerror("Dates required", "Depart and Return dates are required.")
             return
 
-        for i in self.tree.get_children():
-            self.tree.delete(i)
-        self.details_text.delete("1.0", "end")
-        self.results = []
-        self.status_var.set("Searching…")
-        threading.Thread(target=self._search_worker, daemon=True).start()
+        params = self._upstream_params()
+        key = tuple(sorted(params.items()))
+        if self._session_reusable(key):
+            # Only client-side filters changed: no new API sweep needed
+            self._apply_filters()
+            return
 
-    def _search_worker(self):
+        self._clear_results()
+        self.session = None
+        self._searching = True
+        self.status_var.set("Searching…")
+        threading.Thread(target=self._search_worker, args=(key, params), daemon=True).start()
+
+    def _session_reusable(self, key):
+        # A sweep with failed calls is retried, and prices are refreshed once stale
+        s = self.session
+        return (s is not None and s["key"] == key and not s["superset"].get("errors")
+                and time.monotonic() - s["fetched_at"] < SESSION_MAX_AGE_SECONDS)
+
+    def _upstream_params(self):
+        # Everything that changes what Amadeus returns; filters are applied locally
+        env = self.env_var.get().strip().lower()
+        return {
+            "client_id": self.client_id_var.get().strip(),
+            "client_secret": self.client_secret_var.get().strip(),
+            "hostname": "production" if env == "production" else None,
+            "hub": self.hub_var.get().strip().upper(),
+            "dest": self.dest_var.get().strip().upper(),
+            "depart_date": self.depart_var.get().strip(),
+            "return_date": self.return_var.get().strip(),
+            "adults": int(self.adults_var.get()),
+            "currency": self.currency_var.get().strip().upper(),
+            "travel_class": self.cabin_var.get().strip().upper(),
+            "enable_feeders": bool(self.enable_feeders_var.get()),
+            "regions": tuple(k for k, v in self.region_vars.items() if v.get()),
+            "max_detour_ratio": float(self.cfg.get("max_detour_ratio", core.MAX_DETOUR_RATIO)),
+            "max_added_miles": float(self.cfg.get("max_added_miles", core.MAX_ADDED_MILES)),
+            "call_budget": self.cfg.get("call_budget"),
+            # Optional radius-based feeder discovery around the HUB (config.json)
+            "feeder_radius_miles": self.cfg.get("feeder_radius_miles"),
+            "feeder_nearest": self.cfg.get("feeder_nearest"),
+            "feeder_countries": tuple(c.upper() for c in self.cfg.get("feeder_countries") or ()) or None,
+        }
+
+    def on_estimate(self):
+        # Dry run: show the exact call plan for the current inputs without calling Amadeus
+        params = self._upstream_params()
         try:
-            earning_table = core.load_earning_table(self.earnings_path_var.get().strip())
-            env = self.env_var.get().strip().lower()
-            hostname = "production" if env == "production" else None
-
-            hub = self.hub_var.get().strip().upper()
-            dest = self.dest_var.get().strip().upper()
-            depart_date = self.depart_var.get().strip()
-            return_date = self.return_var.get().strip()
-            adults = int(self.adults_var.get())
-            currency = self.currency_var.get().strip().upper()
-            travel_class = self.cabin_var.get().strip().upper()
-            max_results = int(self.max_var.get())
-            strict_cx = bool(self.strict_cx_var.get())
-            nonstop_direct = bool(self.nonstop_direct_var.get())
-
-            # 1) HUB ⇄ DEST (direct first)
-            hubdest_offers = core.search_roundtrip_get(
-                client_id=self.client_id_var.get().strip(),
-                client_secret=self.client_secret_var.get().strip(),
-                origin=hub,
-                dest=dest,
-                depart_date=depart_date,
-                return_date=return_date,
-                adults=adults,
-                currency=currency,
-                max_results=max_results,
-                hostname=hostname,
-                travel_class=travel_class,
-                non_stop=nonstop_direct
+            plan = core.plan_search_calls(
+                params["hub"], params["dest"], params["depart_date"], params["return_date"],
+                params["regions"], params["enable_feeders"],
+                params["max_detour_ratio"], params["max_added_miles"], params["call_budget"],
+                params["feeder_radius_miles"], params["feeder_nearest"], params["feeder_countries"],
             )
+        except ValueError as e:
+            messagebox.showerror("Invalid inputs", str(e))
+            return
+        info = core.describe_plan(plan, params["hostname"])
+
+        lines = [
+            f"Planned Amadeus calls: {info['calls']} "
+            f"(HUB⇄DEST {info['direct_calls']}, feeders {info['feeder_calls']} over {info['feeder_origins']} origins)",
+            f"Estimated time: ~{core.fmt_minutes(round(info['estimated_seconds'] / 60))} "
+            f"({info['estimated_seconds']:.0f}s)",
+            f"Call budget: {params['call_budget'] if params['call_budget'] is not None else 'none'}"
+            f" | Dropped by budget: {info['dropped_by_budget']} | Origins pruned by detour: {info['pruned_origins']}",
+            "",
+        ]
+        lines += [f" {i}. {c['route']}" + (f" {c['ods'][0]['departureDateTimeRange']['date']}"
+                                            f" / {c['ods'][-1]['departureDateTimeRange']['date']}"
+                                            if c["kind"] == "feeder" else "")
+                  for i, c in enumerate(plan["calls"], 1)]
+        self.details_text.delete("1.0", "end")
+        self.details_text.insert("1.0", "\n".join(lines))
+        self.status_var.set(f"Estimate: {info['calls']} calls")
 
-            if strict_cx:
-                hubdest_offers = [o for o in hubdest_offers if core.offer_is_all_cx(o)]
-
-            # Prefer true nonstop RT offers at top; otherwise show whatever returned
-            hubdest_nonstop = [o for o in hubdest_offers if core.is_roundtrip_nonstop(o)]
-            direct_list = hubdest_nonstop if hubdest_nonstop else hubdest_offers
-
-            enriched = []
-
-            def add_offer(kind, new_origin, via_hub, offer):
-                price = offer.get("price", {}).get("grandTotal")
-                cur = offer.get("price", {}).get("currency", currency)
-                total_min, total_miles, segs = core.compute_offer_metrics(offer, self.airports)
-
-                fare_type = core.infer_fare_type_from_offer(offer).upper()
-                if fare_type not in {"LIGHT", "ESSENTIAL", "FLEX"}:
-                    fare_type = "UNKNOWN"
-
-                est_sp, est_am, _ = core.estimate_earnings(segs, earning_table, fare_type)
-                stops = core.count_stops_all_itineraries(offer)
-
-                enriched.append({
-                    "type": kind,
-                    "new_origin": new_origin,
-                    "via_hub": via_hub,
-                    "price_amount": price,
-                    "currency": cur,
-                    "total_minutes": total_min,
-                    "stops": stops,
-                    "travel_class_filter": travel_class,
-                    "cx_only": core.offer_is_all_cx(offer),
-                    "estimated_sp": est_sp,
-                    "estimated_am": est_am,
-                    "segments": segs,
-                    "raw_offer": offer
-                })
-
-            # Add HUB⇄DEST first
-            for o in direct_list[:max_results]:
-                add_offer("HUB⇄DEST", hub, "-", o)
-
-            # 2) NEW_ORIGIN → HUB → DEST → HUB → NEW_ORIGIN
-            if bool(self.enable_feeders_var.get()):
-                selected_regions = [k for k, v in self.region_vars.items() if v.get()]
-                candidate_origins = core.expand_new_origins(selected_regions)
-
-                # Bound the search (can be increased)
-                candidate_origins = candidate_origins[:40]
-
-                feeder_collected = []
-                seen = set()
-
-                for new_origin in candidate_origins:
-                    if new_origin in {hub, dest}:
-                        continue
-
-                    bodies = core.build_new_origin_via_hub_bodies(new_origin, hub, dest, depart_date, return_date)
-
-                    for ods in bodies:
-                        offers = core.search_multicity_post(
-                            client_id=self.client_id_var.get().strip(),
-                            client_secret=self.client_secret_var.get().strip(),
-                            origin_destinations=ods,
-                            adults=adults,
-                            currency=currency,
-                            max_results=3,
-                            hostname=hostname,
-                            travel_class=travel_class
-                        )
-                        if strict_cx:
-                            offers = [o for o in offers if core.offer_is_all_cx(o)]
-                        for o in offers:
-                            oid = o.get("id", "")
-                            key = (new_origin, oid)
-                            if key in seen:
-                                continue
-                            seen.add(key)
-                            feeder_collected.append((new_origin, o))
-
-                # Sort feeder options by price (best effort)
-                def price_float(offer):
-                    try:
-                        return float(offer.get("price", {}).get("grandTotal", "1e18"))
-                    except Exception:
-                        return 1e18
-
-                feeder_collected.sort(key=lambda x: price_float(x[1]))
-
-                for new_origin, o in feeder_collected[:max_results]:
-                    add_offer("NEW→HUB→DEST", new_origin, hub, o)
-
-            self.results = enriched
-            self.after(0, self._render_results)
+    def _search_worker(self, key, params):
+        try:
+            superset = core.fetch_search_superset(
+                **params,
+                call_timeout=self.cfg.get("call_timeout", 30),
+                hedge_after=self.cfg.get("hedge_after"),
+                breaker=self.breaker,
+            )
+            session = {"key": key, "params": params, "superset": superset, "alerts": 0,
+                       "fetched_at": time.monotonic()}
+            self._index_session(session, self.earnings_path_var.get().strip())
+            if self.alerts is not None:
+                # Alerts look at the whole superset, not just what the current filters show
+                session["alerts"] = len(self.alerts.process(session["table"].rows()))
+            self.session = session
+            self.after(0, self._search_done)
 
         except Exception as e:
+            self._searching = False
             self.after(0, lambda: self._show_error(str(e)))
 
+    def _index_session(self, session, earnings_path):
+        # Enrich every offer once per session (and earnings file) into a columnar table;
+        # filter changes then only run vectorized selections over it.
+        params = session["params"]
+        superset = session["superset"]
+        earning_table = core.load_earning_table(earnings_path)
+
+        def enrich(kind, new_origin, via_hub, offer):
+            return core.enrich_offer(kind, new_origin, via_hub, offer, self.airports, earning_table,
+                                     params["currency"], params["travel_class"])
+
+        enriched = [enrich(cathay_table.DIRECT, params["hub"], "-", o) for o in superset["direct"]]
+        enriched += [enrich(cathay_table.FEEDER, n, params["hub"], o) for n, o in superset["feeders"]]
+        session["table"] = cathay_table.OfferTable.from_results(enriched)
+        session["earnings_path"] = earnings_path
+
+    def _search_done(self):
+        self._searching = False
+        self._apply_filters()
+        if self.session.get("alerts"):
+            self.status_var.set(f"{self.status_var.get()} | Price alerts: {self.session['alerts']}")
+
+    def _on_filter_change(self, *_args):
+        if self.session is not None and not self._searching:
+            self._apply_filters()
+
+    def _apply_filters(self):
+        try:
+            max_results = int(self.max_var.get())
+        except (tk.TclError, ValueError):
+            return  # Spinbox is mid-edit
+
+        earnings_path = self.earnings_path_var.get().strip()
+        if self.session.get("earnings_path") != earnings_path:
+            self._index_session(self.session, earnings_path)
+
+        # HUB⇄DEST first, then NEW_ORIGIN → HUB → DEST → HUB → NEW_ORIGIN
+        enriched = cathay_table.apply_result_filters(
+            self.session["table"],
+            strict_cx=bool(self.strict_cx_var.get()),
+            nonstop_direct=bool(self.nonstop_direct_var.get()),
+            max_results=max_results,
+        )
+
+        self._clear_results()
+        self.results = enriched
+        self._render_results()
+
+        # Partial results: list the routes that failed or were skipped
+        errors = self.session["superset"].get("errors") or {}
+        if errors:
+            self.status_var.set(f"Done. Results: {len(self.results)} (errors on {len(errors)} route(s), see Details)")
+            lines = ["Some calls failed; results above are partial.", ""]
+            lines += core.summarize_search_errors(errors)
+            self.details_text.insert("1.0", "\n".join(lines))
+
+        pruned = self.session["superset"].get("pruned") or {}
+        if pruned:
+            self.status_var.set(f"{self.status_var.get()} | Feeders pruned by detour: {len(pruned)}")
+
+    def _clear_results(self):
+        for i in self.tree.get_children():
+            self.tree.delete(i)
+        self.details_text.delete("1.0", "end")
+        self.results = []
+
     def _render_results(self):
         for idx, r in enumerate(self.results):
             self.tree.insert("", "end", iid=str(idx), values=(
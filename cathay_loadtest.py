@@ -0,0 +1,401 @@
+#!/usr/bin/env python3
+# cathay_loadtest.py
+"""
+Load test for the search workflow against a local Amadeus stand-in.
+
+Starts a fake Flight Offers Search server (configurable latency, payload size and
+429/500 injection, including periodic 429 storms), drives the cathay_core search
+functions from many concurrent workers and reports throughput, p50/p95/p99 latency,
+error breakdown and memory.
+
+  python cathay_loadtest.py --mode feeder --scenarios 500 --concurrency 32 --latency-ms 300
+  python cathay_loadtest.py --serve-only --port 8088        # stand-in only
+  python cathay_loadtest.py --target http://127.0.0.1:8088  # drive an already running one
+"""
+import argparse
+import gzip
+import json
+import math
+import random
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import cathay_core as core
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+CARRIERS = ["CX", "CX", "CX", "BA", "JL", "SQ"]
+CABINS = ["ECONOMY", "PREMIUM_ECONOMY", "BUSINESS", "FIRST"]
+BRANDS = ["LIGHT", "ESSENTIAL", "FLEX"]
+
+
+def _at(date_str: str, hour: int) -> str:
+    return f"{date_str}T{hour:02d}:00:00"
+
+
+def _fake_offer(idx: int, legs: list, cabin: str, currency: str, pad: int, rng: random.Random) -> dict:
+    """
+    One flight-offer shaped like the real thing, for legs [(origin, dest, date), ...].
+    Some legs get a connection so stops/non-stop filters have something to do.
+    """
+    itineraries = []
+    fare_details = []
+    seg_id = 0
+    carrier = rng.choice(CARRIERS)
+    for origin, dest, date in legs:
+        hops = [origin, dest] if rng.random() < 0.7 else [origin, "TPE" if origin != "TPE" else "MNL", dest]
+        segments = []
+        for a, b in zip(hops, hops[1:]):
+            seg_id += 1
+            segments.append({
+                "departure": {"iataCode": a, "at": _at(date, 8 + seg_id % 12)},
+                "arrival": {"iataCode": b, "at": _at(date, 11 + seg_id % 12)},
+                "carrierCode": carrier if rng.random() < 0.9 else rng.choice(CARRIERS),
+                "number": str(100 + rng.randrange(800)),
+                "aircraft": {"code": "359"},
+                "duration": f"PT{2 + seg_id % 10}H{(seg_id * 7) % 60}M",
+                "id": str(seg_id),
+                "numberOfStops": 0,
+            })
+            fare_details.append({
+                "segmentId": str(seg_id),
+                "cabin": cabin,
+                "fareBasis": "XXXXXX",
+                "brandedFare": rng.choice(BRANDS),
+                "class": rng.choice("JCDIYBHKM"),
+            })
+        itineraries.append({"duration": f"PT{4 * len(segments)}H", "segments": segments})
+
+    price = f"{1500 + idx * 37 + rng.randrange(500)}.00"
+    offer = {
+        "type": "flight-offer",
+        "id": str(idx + 1),
+        "source": "GDS",
+        "itineraries": itineraries,
+        "price": {"currency": currency, "total": price, "base": price, "grandTotal": price},
+        "travelerPricings": [{"travelerId": "1", "travelerType": "ADULT", "fareDetailsBySegment": fare_details}],
+    }
+    if pad:
+        offer["fareRules"] = {"text": "x" * pad}
+    return offer
+
+
+class FakeAmadeusServer:
+    """
+    In-process stand-in for the Amadeus token and Flight Offers Search endpoints.
+
+    Every search response waits latency_ms ± jitter_ms, then either fails (429 with
+    rate_429, 500 with rate_500, or 429 for the whole storm window) or returns up to
+    `offers` offers (capped by the request's max / maxFlightOffers), gzip-compressed
+    when the client asks for it.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency_ms=150.0, jitter_ms=50.0, offers=50, pad=0,
+                 rate_429=0.0, rate_500=0.0, storm_period=0.0, storm_length=0.0, seed=1):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.offers = offers
+        self.pad = pad
+        self.rate_429 = rate_429
+        self.rate_500 = rate_500
+        self.storm_period = storm_period
+        self.storm_length = storm_length
+        self.rng = random.Random(seed)
+        self.started_at = time.monotonic()
+        self.counts = {}
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        self._httpd.serve_forever()
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def _count(self, status: int):
+        with self._lock:
+            self.counts[status] = self.counts.get(status, 0) + 1
+
+    def _in_storm(self) -> bool:
+        if self.storm_period <= 0 or self.storm_length <= 0:
+            return False
+        return (time.monotonic() - self.started_at) % self.storm_period < self.storm_length
+
+    def _pick_failure(self):
+        if self._in_storm():
+            return 429
+        with self._lock:
+            roll = self.rng.random()
+        if roll < self.rate_429:
+            return 429
+        if roll < self.rate_429 + self.rate_500:
+            return 500
+        return None
+
+    def _search_body(self, legs: list, cabin: str, currency: str, limit: int) -> bytes:
+        with self._lock:
+            rng = random.Random(self.rng.random())
+        n = max(0, min(self.offers, limit))
+        data = [_fake_offer(i, legs, cabin, currency, self.pad, rng) for i in range(n)]
+        data.sort(key=core.offer_price)
+        for i, o in enumerate(data, 1):
+            o["id"] = str(i)
+        return json.dumps({"meta": {"count": n}, "data": data, "dictionaries": {"carriers": {c: c for c in CARRIERS}}}).encode()
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            wbufsize = -1
+
+            def log_message(self, *_args):
+                pass
+
+            def _send(self, status: int, payload: bytes, extra_headers=None):
+                if "gzip" in (self.headers.get("Accept-Encoding") or ""):
+                    payload = gzip.compress(payload, 1)
+                    extra_headers = dict(extra_headers or {}, **{"Content-Encoding": "gzip"})
+                self.send_response(status)
+                self.send_header("Content-Type", "application/vnd.amadeus+json")
+                self.send_header("Content-Length", str(len(payload)))
+                for k, v in (extra_headers or {}).items():
+                    self.send_header(k, v)
+                self.end_headers()
+                self.wfile.write(payload)
+                self.wfile.flush()
+                server._count(status)
+
+            def _error(self, status: int, title: str):
+                body = json.dumps({"errors": [{"status": status, "code": 38194 if status == 429 else 141,
+                                               "title": title, "detail": "injected by load test"}]}).encode()
+                self._send(status, body, {"Retry-After": "1"} if status == 429 else None)
+
+            def _delay(self):
+                jitter = server.rng.uniform(-server.jitter_ms, server.jitter_ms) if server.jitter_ms else 0.0
+                time.sleep(max(0.0, server.latency_ms + jitter) / 1000.0)
+
+            def do_POST(self):
+                raw = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                path = urlsplit(self.path).path
+                if path == "/v1/security/oauth2/token":
+                    body = {"type": "amadeusOAuth2Token", "access_token": "loadtest", "expires_in": 1799}
+                    return self._send(200, json.dumps(body).encode())
+                if path != core.FLIGHT_OFFERS_PATH:
+                    return self._error(404, "NOT FOUND")
+
+                req = json.loads(raw or b"{}")
+                self._delay()
+                failure = server._pick_failure()
+                if failure:
+                    return self._error(failure, "Too many requests" if failure == 429 else "SYSTEM ERROR HAS OCCURRED")
+
+                legs = [(od.get("originLocationCode"), od.get("destinationLocationCode"),
+                         od.get("departureDateTimeRange", {}).get("date", "2026-01-01"))
+                        for od in req.get("originDestinations", [])]
+                criteria = req.get("searchCriteria") or {}
+                limit = int(criteria.get("maxFlightOffers") or core.MAX_FLIGHT_OFFERS)
+                cabin = criteria.get("travelClass") or "ECONOMY"
+                self._send(200, server._search_body(legs, cabin, req.get("currencyCode", "HKD"), limit))
+
+            def do_GET(self):
+                parts = urlsplit(self.path)
+                if parts.path != core.FLIGHT_OFFERS_PATH:
+                    return self._error(404, "NOT FOUND")
+
+                q = {k: v[0] for k, v in parse_qs(parts.query).items()}
+                self._delay()
+                failure = server._pick_failure()
+                if failure:
+                    return self._error(failure, "Too many requests" if failure == 429 else "SYSTEM ERROR HAS OCCURRED")
+
+                origin, dest = q.get("originLocationCode"), q.get("destinationLocationCode")
+                legs = [(origin, dest, q.get("departureDate", "2026-01-01"))]
+                if q.get("returnDate"):
+                    legs.append((dest, origin, q["returnDate"]))
+                limit = int(q.get("max") or core.MAX_FLIGHT_OFFERS)
+                self._send(200, server._search_body(legs, q.get("travelClass", "ECONOMY"), q.get("currencyCode", "HKD"), limit))
+
+        return Handler
+
+
+def build_scenarios(n: int, seed: int) -> list:
+    rng = random.Random(seed)
+    hubs = ["HKG", "TPE", "BKK"]
+    dests = ["LHR", "NRT", "SYD", "JFK", "CDG", "FRA"]
+    origins = sorted({a for pool in core.NEW_ORIGIN_POOLS.values() for a in pool})
+    base = datetime(2026, 3, 1).date()
+    scenarios = []
+    for i in range(n):
+        depart = base + timedelta(days=rng.randrange(60))
+        scenarios.append({
+            "id": i,
+            "hub": rng.choice(hubs),
+            "dest": rng.choice(dests),
+            "new_origin": rng.choice(origins),
+            "depart": depart.isoformat(),
+            "return": (depart + timedelta(days=3 + rng.randrange(10))).isoformat(),
+            "cabin": rng.choice(["ANY"] + CABINS),
+        })
+    return scenarios
+
+
+def run_scenario(sc: dict, args, target: str):
+    """
+    Runs one scenario and returns (elapsed_seconds, offers, error_label or None).
+      direct: one HUB⇄DEST round-trip GET
+      feeder: one 4-leg NEW_ORIGIN→HUB→DEST POST
+      sweep:  a full fetch_search_superset() over --regions (what the GUI does)
+    """
+    common = dict(client_id="loadtest", client_secret="loadtest", adults=1, currency="HKD", hostname=target,
+                  travel_class=sc["cabin"])
+    t0 = time.perf_counter()
+    try:
+        if args.mode == "direct":
+            res = core.call_with_deadline(lambda: core.search_roundtrip_get(
+                origin=sc["hub"], dest=sc["dest"], depart_date=sc["depart"], return_date=sc["return"],
+                max_results=args.max, **common), args.call_timeout, args.hedge_after)
+            n = len(res)
+        elif args.mode == "feeder":
+            ods = core.build_new_origin_via_hub_bodies(sc["new_origin"], sc["hub"], sc["dest"],
+                                                       sc["depart"], sc["return"])[0]
+            res = core.call_with_deadline(lambda: core.search_multicity_post(
+                origin_destinations=ods, max_results=args.max, **common), args.call_timeout, args.hedge_after)
+            n = len(res)
+        else:
+            res = core.fetch_search_superset(hub=sc["hub"], dest=sc["dest"], depart_date=sc["depart"],
+                                             return_date=sc["return"], regions=args.regions,
+                                             call_timeout=args.call_timeout, hedge_after=args.hedge_after, **common)
+            n = len(res["direct"]) + len(res["feeders"])
+            if res["errors"]:
+                # Partial sweep: count it by its first failure reason
+                m = core.API_ERROR_RE.search(next(iter(res["errors"].values()))[0])
+                return time.perf_counter() - t0, n, "partial:" + (m.group(1) if m else "skipped")
+        return time.perf_counter() - t0, n, None
+    except Exception as e:
+        m = core.API_ERROR_RE.search(str(e))
+        return time.perf_counter() - t0, 0, m.group(1) if m else type(e).__name__
+
+
+def percentile(sorted_values: list, pct: float) -> float:
+    # Nearest-rank percentile over an already sorted list
+    if not sorted_values:
+        return 0.0
+    k = max(0, min(len(sorted_values) - 1, math.ceil(pct / 100.0 * len(sorted_values)) - 1))
+    return sorted_values[k]
+
+
+def max_rss_mb():
+    if resource is None:
+        return None
+    # ru_maxrss is KiB on Linux (bytes on macOS; close enough for a capacity hint)
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Load test cathay_core searches against a local Amadeus stand-in.")
+    ap.add_argument("--mode", choices=["direct", "feeder", "sweep"], default="feeder")
+    ap.add_argument("--scenarios", type=int, default=200, help="Number of searches to run")
+    ap.add_argument("--concurrency", type=int, default=16)
+    ap.add_argument("--max", type=int, default=3, help="max_results per search call")
+    ap.add_argument("--regions", nargs="*", default=["Taiwan", "Korea"], help="Regions for --mode sweep")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--call-timeout", type=float, help="Per-call deadline in seconds")
+    ap.add_argument("--hedge-after", type=float, help="Send a hedged duplicate after this many seconds")
+    ap.add_argument("--trace-memory", action="store_true", help="Report tracemalloc peak (slows the run)")
+
+    srv = ap.add_argument_group("stand-in server")
+    srv.add_argument("--target", help="Use an already running stand-in at this base URL instead of starting one")
+    srv.add_argument("--serve-only", action="store_true", help="Only run the stand-in server")
+    srv.add_argument("--port", type=int, default=0)
+    srv.add_argument("--latency-ms", type=float, default=150.0)
+    srv.add_argument("--jitter-ms", type=float, default=50.0)
+    srv.add_argument("--offers", type=int, default=50, help="Offers per response (before max/maxFlightOffers)")
+    srv.add_argument("--pad", type=int, default=0, help="Extra bytes per offer to inflate payloads")
+    srv.add_argument("--rate-429", type=float, default=0.0)
+    srv.add_argument("--rate-500", type=float, default=0.0)
+    srv.add_argument("--storm-period", type=float, default=0.0, help="Seconds between 429 storms")
+    srv.add_argument("--storm-length", type=float, default=0.0, help="Seconds each 429 storm lasts")
+
+    args = ap.parse_args()
+
+    server = None
+    target = args.target
+    if not target:
+        server = FakeAmadeusServer(
+            port=args.port, latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, offers=args.offers, pad=args.pad,
+            rate_429=args.rate_429, rate_500=args.rate_500,
+            storm_period=args.storm_period, storm_length=args.storm_length, seed=args.seed,
+        )
+        target = server.url
+        if args.serve_only:
+            print(f"Amadeus stand-in listening on {target} (Ctrl+C to stop)")
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+            return
+        server.start()
+
+    scenarios = build_scenarios(args.scenarios, args.seed)
+    if args.trace_memory:
+        tracemalloc.start()
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(lambda sc: run_scenario(sc, args, target), scenarios))
+    wall = time.perf_counter() - t0
+
+    traced_peak = tracemalloc.get_traced_memory()[1] if args.trace_memory else None
+    if server is not None:
+        server.stop()
+
+    ok = sorted(r[0] for r in results if r[2] is None)
+    errors = {}
+    for _, _, err in results:
+        if err is not None:
+            errors[err] = errors.get(err, 0) + 1
+
+    print(f"\n=== Load test: mode={args.mode} scenarios={len(results)} concurrency={args.concurrency} ===")
+    print(f"Target: {target}")
+    print(f"Wall time: {wall:.2f}s | Throughput: {len(results) / wall:.1f} searches/s")
+    print(f"OK: {len(ok)} | Errors: {sum(errors.values())} {errors if errors else ''}")
+    print(f"Offers returned: {sum(r[1] for r in results)}")
+    if ok:
+        print("Latency (ok): p50 {:.0f} ms | p95 {:.0f} ms | p99 {:.0f} ms | max {:.0f} ms".format(
+            *(percentile(ok, p) * 1000 for p in (50, 95, 99, 100))))
+    stats = core.HTTP_TRANSPORT.stats
+    print(f"HTTP: requests {stats['requests']} | connections {stats['connections']} | "
+          f"wire {stats['bytes_wire'] / 1e6:.2f} MB | decoded {stats['bytes_decoded'] / 1e6:.2f} MB")
+    rss = max_rss_mb()
+    if rss is not None:
+        print(f"Max RSS: {rss:.1f} MB")
+    if traced_peak is not None:
+        print(f"Traced Python heap peak: {traced_peak / 1e6:.1f} MB")
+    if server is not None:
+        print(f"Stand-in responses by status: {dict(sorted(server.counts.items()))}")
+
+
+if __name__ == "__main__":
+    main()
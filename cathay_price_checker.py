@@ -11,35 +11,78 @@ def main():
     ap.add_argument("--return-date", required=True, help="Return date for DEST→HUB (YYYY-MM-DD)")
     ap.add_argument("--adults", type=int, default=1)
     ap.add_argument("--currency", default="HKD")
-    ap.add_argument("--max", type=int, default=20)
+    ap.add_argument("--max", type=int, default=20, help="HUB⇄DEST offers to request, and rows to show per block")
     ap.add_argument("--env", choices=["test", "production"], default="test")
     ap.add_argument("--cabin", choices=["ANY", "ECONOMY", "PREMIUM_ECONOMY", "BUSINESS", "FIRST"], default="ANY")
     ap.add_argument("--cx-only", action="store_true")
     ap.add_argument("--regions", nargs="*", default=["China","Singapore","Malaysia","Indonesia","Japan","Korea","Taiwan"])
     ap.add_argument("--nonstop-direct", action="store_true", help="Request nonStop=True for HUB⇄DEST search")
+    ap.add_argument("--max-detour-ratio", type=float, default=core.MAX_DETOUR_RATIO,
+                    help="Skip feeder origins whose route via HUB is this many times the direct distance")
+    ap.add_argument("--max-added-miles", type=float, default=core.MAX_ADDED_MILES,
+                    help="Skip feeder origins whose route via HUB adds more than this many miles")
+    ap.add_argument("--feeder-radius", type=float,
+                    help="Also try Cathay-served airports (core.CX_NETWORK, a hand-kept list) within this many miles of HUB; off by default")
+    ap.add_argument("--feeder-nearest", type=int, help="Also try the N Cathay-served airports nearest to HUB; off by default")
+    ap.add_argument("--feeder-countries", nargs="*", help="Limit --feeder-radius/--feeder-nearest to these country codes (e.g. JP KR)")
+    ap.add_argument("--budget", type=int, help="Hard cap on Amadeus calls; the most valuable calls are made first")
+    ap.add_argument("--dry-run", action="store_true", help="Print the call plan and estimated time, make no API calls")
+    ap.add_argument("--call-timeout", type=float, default=30.0, help="Per-call deadline in seconds")
+    ap.add_argument("--hedge-after", type=float, help="Send a hedged duplicate after this many seconds (ignored with --budget)")
 
     args = ap.parse_args()
 
+    hostname = "production" if args.env == "production" else None
+
+    hub = args.hub.upper()
+    dest = args.dest.upper()
+
+    plan = core.plan_search_calls(
+        hub, dest, args.depart, args.return_date, args.regions,
+        max_detour_ratio=args.max_detour_ratio, max_added_miles=args.max_added_miles,
+        call_budget=args.budget, feeder_radius_miles=args.feeder_radius,
+        feeder_nearest=args.feeder_nearest, feeder_countries=args.feeder_countries
+    )
+    if args.dry_run:
+        info = core.describe_plan(plan, hostname)
+        print(f"Planned calls: {info['calls']} (HUB⇄DEST {info['direct_calls']}, "
+              f"feeders {info['feeder_calls']} over {info['feeder_origins']} origins)")
+        print(f"Estimated time: ~{info['estimated_seconds']:.0f}s (one call at a time, ~{core.AVG_CALL_SECONDS:g}s each)")
+        print(f"Dropped by budget: {info['dropped_by_budget']} | Origins pruned by detour: {info['pruned_origins']}")
+        for i, c in enumerate(plan["calls"], 1):
+            if c["kind"] == "feeder":
+                ods = c["ods"]
+                print(f"{i}. {c['route']} {ods[0]['departureDateTimeRange']['date']} / {ods[-1]['departureDateTimeRange']['date']}")
+            else:
+                print(f"{i}. {c['route']}")
+        return
+
     cid = os.getenv("AMADEUS_CLIENT_ID")
     csec = os.getenv("AMADEUS_CLIENT_SECRET")
     if not cid or not csec:
         raise SystemExit("Missing AMADEUS_CLIENT_ID / AMADEUS_CLIENT_SECRET env vars")
 
-    hostname = "production" if args.env == "production" else None
+    direct_call = next((c for c in plan["calls"] if c["kind"] == "direct"), None)
+    if direct_call is None:
+        raise SystemExit("Call budget leaves no room for the HUB⇄DEST search")
+    # The CLI asks Amadeus for exactly what its flags say, instead of the GUI's superset
+    direct_call["max_results"] = args.max
+    direct_call["non_stop"] = args.nonstop_direct
 
-    hub = args.hub.upper()
-    dest = args.dest.upper()
-
-    # 1) HUB ⇄ DEST
-    offers = core.search_roundtrip_get(
+    # Same sweep as the GUI: every call has a deadline, failing routes are skipped
+    # and reported, and whatever did come back is still printed
+    superset = core.fetch_search_superset(
         client_id=cid, client_secret=csec,
-        origin=hub, dest=dest,
+        hub=hub, dest=dest,
         depart_date=args.depart, return_date=args.return_date,
         adults=args.adults, currency=args.currency.upper(),
-        max_results=args.max, hostname=hostname,
-        travel_class=args.cabin,
-        non_stop=args.nonstop_direct
+        travel_class=args.cabin, hostname=hostname,
+        call_timeout=args.call_timeout, hedge_after=args.hedge_after,
+        call_budget=args.budget, plan=plan
     )
+
+    # 1) HUB ⇄ DEST
+    offers = superset["direct"]
     if args.cx_only:
         offers = [o for o in offers if core.offer_is_all_cx(o)]
 
@@ -56,42 +99,22 @@ def main():
 
     # 2) NEW_ORIGIN → HUB → DEST → HUB → NEW_ORIGIN
     print("\n=== NEW_ORIGIN→HUB→DEST options ===")
-    candidates = core.expand_new_origins(args.regions)[:40]
-    collected = []
-    seen = set()
-
-    for new_origin in candidates:
-        if new_origin in {hub, dest}:
-            continue
-        for ods in core.build_new_origin_via_hub_bodies(new_origin, hub, dest, args.depart, args.return_date):
-            resp = core.search_multicity_post(
-                client_id=cid, client_secret=csec,
-                origin_destinations=ods,
-                adults=args.adults, currency=args.currency.upper(),
-                max_results=2, hostname=hostname,
-                travel_class=args.cabin
-            )
-            if args.cx_only:
-                resp = [o for o in resp if core.offer_is_all_cx(o)]
-            for o in resp:
-                key = (new_origin, o.get("id", ""))
-                if key in seen:
-                    continue
-                seen.add(key)
-                collected.append((new_origin, o))
-
-    def price_float(offer):
-        try:
-            return float(offer.get("price", {}).get("grandTotal", "1e18"))
-        except Exception:
-            return 1e18
-
-    collected.sort(key=lambda x: price_float(x[1]))
+    for o, reason in sorted(superset["pruned"].items()):
+        print(f"(skipped {o}: {reason})")
+    collected = superset["feeders"]
+    if args.cx_only:
+        collected = [(n, o) for n, o in collected if core.offer_is_all_cx(o)]
+    collected.sort(key=lambda x: core.offer_price(x[1]))
 
     for new_origin, o in collected[:args.max]:
         price = o.get("price", {}).get("grandTotal")
         cur = o.get("price", {}).get("currency", args.currency.upper())
         print(f"- {new_origin} → {hub} → {dest}: {cur} {price}")
 
+    if superset["errors"]:
+        print("\n=== Failed calls (results above are partial) ===")
+        for line in core.summarize_search_errors(superset["errors"]):
+            print(line)
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
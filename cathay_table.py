@@ -0,0 +1,159 @@
+# cathay_table.py
+"""
+Columnar table over enriched search results (see core.enrich_offer()).
+
+Each field is one NumPy array; string fields (kind, origin, hub, currency) are stored
+as integer codes into a small category array. A table is those columns plus an index
+array, so where()/sort_by()/head() return cheap views and filters, sorts and
+group-bys run vectorized instead of looping over nested offer dicts.
+
+  t = OfferTable.from_results(enriched)
+  cheap = t.where(t["cx"] & (t["stops"] <= 2)).sort_by("price").head(20)
+  per_origin = t.cheapest_per("origin")      # one row per origin, cheapest first
+  t.group_min("depart")                      # {date: cheapest price}
+"""
+import numpy as np
+
+import cathay_core as core
+
+DIRECT = "HUB⇄DEST"
+FEEDER = "NEW→HUB→DEST"
+
+
+def _depart_date(r: dict) -> str:
+    segs = r.get("segments") or []
+    return (segs[0].get("dep_at") or "")[:10] if segs else ""
+
+
+class OfferTable:
+    """
+    Columns: price, minutes, stops, cx, nonstop, sp, miles (NaN when unknown),
+    depart (datetime64[D], NaT when unknown) and the categorical kind, origin, hub
+    and currency. rows() maps back to the enriched result dicts.
+    """
+
+    def __init__(self, columns: dict, categories: dict, results: list, index=None):
+        self._columns = columns
+        self._categories = categories
+        self._results = results
+        self._index = np.arange(len(results)) if index is None else index
+
+    @classmethod
+    def from_results(cls, results: list) -> "OfferTable":
+        results = list(results)
+        n = len(results)
+
+        def floats(key):
+            return np.array([np.nan if r.get(key) is None else float(r[key]) for r in results], dtype=np.float64)
+
+        columns = {
+            "price": np.fromiter((core.offer_price(r.get("raw_offer") or {}) for r in results), np.float64, n),
+            "minutes": np.fromiter((r.get("total_minutes") or 0 for r in results), np.int32, n),
+            "stops": np.fromiter((r.get("stops") or 0 for r in results), np.int16, n),
+            "cx": np.fromiter((bool(r.get("cx_only")) for r in results), bool, n),
+            "nonstop": np.fromiter((core.is_roundtrip_nonstop(r.get("raw_offer") or {}) for r in results), bool, n),
+            "sp": floats("estimated_sp"),
+            "miles": floats("estimated_am"),
+            "depart": np.array([_depart_date(r) or "NaT" for r in results], dtype="datetime64[D]"),
+        }
+        categories = {}
+        raw = {
+            "kind": [r.get("type") or "" for r in results],
+            "origin": [r.get("new_origin") or "" for r in results],
+            "hub": [(r.get("via_hub") if r.get("type") == FEEDER else r.get("new_origin")) or "" for r in results],
+            "currency": [r.get("currency") or "" for r in results],
+        }
+        for name, values in raw.items():
+            cats, codes = np.unique(np.array(values, dtype=str), return_inverse=True)
+            categories[name] = cats
+            columns[name] = codes.astype(np.int32)
+        return cls(columns, categories, results)
+
+    def __len__(self):
+        return len(self._index)
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        """Column values for the rows in this view; categoricals come back decoded."""
+        col = self._columns[name][self._index]
+        if name in self._categories:
+            return self._categories[name][col]
+        return col
+
+    def codes(self, name: str) -> np.ndarray:
+        return self._columns[name][self._index]
+
+    def eq(self, name: str, value) -> np.ndarray:
+        """Boolean mask for rows where a column equals value (categoricals compare by code)."""
+        if name in self._categories:
+            cats = self._categories[name]
+            i = np.searchsorted(cats, value)
+            if i >= len(cats) or cats[i] != value:
+                return np.zeros(len(self), dtype=bool)
+            return self.codes(name) == i
+        return self[name] == value
+
+    def where(self, mask) -> "OfferTable":
+        return self._view(self._index[np.asarray(mask, dtype=bool)])
+
+    def sort_by(self, name: str, descending: bool = False) -> "OfferTable":
+        # Stable, so ties keep their current order
+        keys = self.codes(name) if name in self._categories else self[name]
+        order = np.argsort(keys, kind="stable")
+        if descending:
+            order = order[::-1]
+        return self._view(self._index[order])
+
+    def head(self, n: int) -> "OfferTable":
+        return self._view(self._index[:max(0, n)])
+
+    def rows(self) -> list:
+        return [self._results[i] for i in self._index]
+
+    def cheapest_per(self, name: str) -> "OfferTable":
+        """One row per distinct value of `name` (the cheapest), ordered by price."""
+        if not len(self):
+            return self
+        keys = self.codes(name) if name in self._categories else self[name]
+        order = np.lexsort((self["price"], keys))
+        sorted_keys = keys[order]
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = sorted_keys[1:] != sorted_keys[:-1]
+        return self._view(self._index[order[first]]).sort_by("price")
+
+    def group_min(self, name: str, value: str = "price") -> dict:
+        """{group: minimum of `value`}, e.g. cheapest price per origin or per date."""
+        keys = self.codes(name) if name in self._categories else self[name]
+        uniq, inverse = np.unique(keys, return_inverse=True)
+        out = np.full(len(uniq), np.nan)
+        np.fmin.at(out, inverse, self[value].astype(np.float64))
+        labels = self._categories[name][uniq] if name in self._categories else uniq
+        return dict(zip(labels.tolist(), out.tolist()))
+
+    def group_count(self, name: str) -> dict:
+        keys = self.codes(name) if name in self._categories else self[name]
+        uniq, counts = np.unique(keys, return_counts=True)
+        labels = self._categories[name][uniq] if name in self._categories else uniq
+        return dict(zip(labels.tolist(), counts.tolist()))
+
+    def _view(self, index) -> "OfferTable":
+        return OfferTable(self._columns, self._categories, self._results, index)
+
+
+def apply_result_filters(table: OfferTable, strict_cx: bool, nonstop_direct: bool, max_results: int) -> list:
+    """
+    Client-side filters over the enriched superset of a search (see
+    core.fetch_search_superset()): HUB⇄DEST rows in search order, then feeder rows by
+    price, each capped at max_results.
+    """
+    direct = table.where(table.eq("kind", DIRECT))
+    feeders = table.where(table.eq("kind", FEEDER))
+    if strict_cx:
+        direct = direct.where(direct["cx"])
+        feeders = feeders.where(feeders["cx"])
+
+    # Prefer true nonstop RT offers; otherwise show whatever returned
+    if nonstop_direct:
+        nonstop = direct.where(direct["nonstop"])
+        direct = nonstop if len(nonstop) else direct
+
+    return direct.head(max_results).rows() + feeders.sort_by("price").head(max_results).rows()